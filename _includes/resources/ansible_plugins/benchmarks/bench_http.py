@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the HTTP plugins, against a local stand-in server
+
+Measures, for the `lilatomic.api.http` action plugin and the httpapi plugin and module:
+- overhead: milliseconds per call, made one after another in one process
+- throughput: calls per second with 1, 10 and 100 hosts at once. Like Ansible, each host's task runs in its own fork
+
+Overhead and throughput are measured in rounds, and the best of each measurement kept, since one-off pauses would otherwise dominate.
+Each round measures everything once, so a burst of load on the machine only spoils one round of each measurement.
+- memory: peak resident memory added by a call which receives a large body
+
+Results can be saved as a baseline, and later runs compared against it to catch regressions.
+Timings depend on the machine, so compare against a baseline saved on the same one.
+
+	python bench_http.py --save baseline.json
+	python bench_http.py --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from ansible.module_utils import basic
+from ansible.module_utils.urls import open_url
+
+from server import StandInServer
+
+PLUGINS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONNECTION_NAME = "bench"
+
+# whether a bigger number is better, for each kind of measurement
+HIGHER_IS_BETTER = {"overhead_ms": False, "throughput_rps": True, "memory_mb": False}
+# changes smaller than these are noise, whatever the tolerance
+MIN_CHANGE = {"overhead_ms": 1.0, "throughput_rps": 1.0, "memory_mb": 8.0}
+ROUNDS = 5
+
+
+def load(name: str, relative_path: str):
+	spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGINS, relative_path))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+
+action_plugin = load("http_action", "better_httpapi/extended_action.py")
+httpapi_plugin = load("http_httpapi", "httpapi/httpapi/extended.py")
+httpapi_module = load("http_module", "httpapi/modules/extended.py")
+
+
+class StandInConnection(object):
+	""" The part of the `ansible.netcommon.httpapi` connection plugin that `HttpApi.send_request` uses
+
+	Like the real one, it sends each request with `open_url` and buffers the body.
+	"""
+
+	def __init__(self, base: str):
+		self.base = base
+
+	def send(self, path, data, method="GET", headers=None, **kwargs):
+		response = open_url(self.base + path, data=data, headers=headers, method=method)
+		return response, io.BytesIO(response.read())
+
+
+class LocalConnection(object):
+	""" Stands in for the RPC connection to the persistent `ansible-connection` process, by calling the httpapi plugin in-process """
+
+	base = None
+
+	def __init__(self, socket_path):
+		self.httpapi = httpapi_plugin.HttpApi(StandInConnection(self.base))
+
+	def __getattr__(self, name):
+		# like the real one, any method of the plugin can be called
+		return getattr(self.httpapi, name)
+
+
+httpapi_module.Connection = LocalConnection
+
+
+@contextlib.contextmanager
+def module_args(args: Dict):
+	try:
+		from ansible.module_utils.testing import patch_module_args
+	except ImportError:
+		# ansible-core before 2.19 reads the args straight from here
+		previous = basic._ANSIBLE_ARGS
+		basic._ANSIBLE_ARGS = json.dumps({"ANSIBLE_MODULE_ARGS": args}).encode("utf-8")
+		try:
+			yield
+		finally:
+			basic._ANSIBLE_ARGS = previous
+	else:
+		with patch_module_args(args):
+			yield
+
+
+def call_action(base: str, **args) -> Dict:
+	task = SimpleNamespace(args=dict(args, connection=CONNECTION_NAME), async_val=0, check_mode=False, action="lilatomic.api.http")
+	connection = SimpleNamespace(_shell=SimpleNamespace(tmpdir="/tmp"))
+	action = action_plugin.ActionModule(task, connection, None, None, None)
+	return action.run(task_vars={action_plugin.NS: {CONNECTION_NAME: {"base": base}}})
+
+
+def call_httpapi(base: str, path: str) -> Dict:
+	return httpapi_plugin.HttpApi(StandInConnection(base)).send_request(path=path, method="GET")
+
+
+def call_module(base: str, path: str, **args) -> Dict:
+	LocalConnection.base = base
+	stdout = io.StringIO()
+	with module_args({"path": path, "method": "GET", "_ansible_socket": CONNECTION_NAME, **args}), contextlib.redirect_stdout(stdout):
+		try:
+			httpapi_module.main()
+		except SystemExit:
+			pass
+	return json.loads(stdout.getvalue())
+
+
+def targets(base: str) -> Dict[str, Callable[[str], Dict]]:
+	return {
+		"action": lambda path: call_action(base, path=path),
+		"httpapi": lambda path: call_httpapi(base, path),
+		"module": lambda path: call_module(base, path),
+		}
+
+
+def overhead(base: str, calls: int) -> Dict[str, float]:
+	out = {}
+	for name, call in targets(base).items():
+		call("/get")  # warm up
+		start = time.perf_counter()
+		for _ in range(calls):
+			call("/get")
+		out[name] = 1000 * (time.perf_counter() - start) / calls
+	# don't let forks inherit sockets from the warm sessions
+	action_plugin.SESSIONS.close()
+	return out
+
+
+def run_forked(call: Callable[[str], Dict], path: str):
+	try:
+		call(path)
+	except Exception:
+		os._exit(1)
+	os._exit(0)
+
+
+def throughput(base: str, calls: int, concurrency: List[int]) -> Dict[str, float]:
+	forks = multiprocessing.get_context("fork")
+	out = {}
+	for name in ("action", "module"):
+		call = targets(base)[name]
+		for hosts in concurrency:
+			total = max(calls, hosts)
+			running = []
+			failures = 0
+			start = time.perf_counter()
+			for _ in range(total):
+				while len(running) >= hosts:
+					failures += reap(running)
+				process = forks.Process(target=run_forked, args=(call, "/get"))
+				process.start()
+				running.append(process)
+			while running:
+				failures += reap(running)
+			if failures:
+				raise RuntimeError(f"{failures} calls through {name} failed")
+			out[f"{name}@{hosts}"] = total / (time.perf_counter() - start)
+
+	# many requests from one task, for comparison
+	for hosts in concurrency:
+		total = max(calls, hosts)
+		start = time.perf_counter()
+		result = call_action(base, requests=[{"path": "/get"}] * total, max_concurrency=hosts)
+		if result["failed"]:
+			raise RuntimeError("bulk requests failed")
+		out[f"action_bulk@{hosts}"] = total / (time.perf_counter() - start)
+		action_plugin.SESSIONS.close()
+
+	# the connection sends a batch one request at a time, so there is no concurrency to vary
+	start = time.perf_counter()
+	result = call_module(base, "/get", requests=[{}] * calls)
+	if result.get("failed"):
+		raise RuntimeError("batched requests failed")
+	out["module_batch"] = calls / (time.perf_counter() - start)
+	return out
+
+
+def reap(running: List) -> int:
+	""" Wait for the oldest process, returning 1 if it failed """
+	process = running.pop(0)
+	process.join()
+	return int(process.exitcode != 0)
+
+
+def measure_memory(call: Callable[[], Dict], pipe):
+	before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	call()
+	after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# ru_maxrss is in KiB on Linux
+	pipe.send((after - before) / 1024)
+	pipe.close()
+
+
+def memory(base: str, size: int, scratch: str) -> Dict[str, float]:
+	path = f"/large?size={size}"
+	calls = {
+		"action": lambda: call_action(base, path=path),
+		"action_return_fields": lambda: call_action(base, path=path, return_fields=["status"]),
+		"action_dest": lambda: call_action(base, path=path, dest=os.path.join(scratch, "large.json")),
+		"httpapi": lambda: call_httpapi(base, path),
+		"module": lambda: call_module(base, path),
+		}
+	forks = multiprocessing.get_context("fork")
+	out = {}
+	for name, call in calls.items():
+		# a fresh process for each, so each starts from the same peak
+		receive, send = forks.Pipe(duplex=False)
+		process = forks.Process(target=measure_memory, args=(call, send))
+		process.start()
+		out[name] = receive.recv()
+		process.join()
+	return out
+
+
+def best_of(rounds: List[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+	""" The best value of each measurement across the rounds """
+	best = {}
+	for kind in rounds[0]:
+		pick = max if HIGHER_IS_BETTER[kind] else min
+		best[kind] = {name: pick(measured[kind][name] for measured in rounds) for name in rounds[0][kind]}
+	return best
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+	""" Measurements which are more than `tolerance` worse than the baseline """
+	regressions = []
+	for kind, higher_is_better in HIGHER_IS_BETTER.items():
+		for name, expected in baseline.get(kind, {}).items():
+			actual = results.get(kind, {}).get(name)
+			if actual is None or not expected or abs(actual - expected) < MIN_CHANGE[kind]:
+				continue
+			change = (actual - expected) / expected
+			if (-change if higher_is_better else change) > tolerance:
+				regressions.append(f"{kind} {name}: {actual:.2f} vs baseline {expected:.2f} ({change:+.0%})")
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--calls", type=int, default=200, help="calls per measurement")
+	parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100], help="numbers of hosts at once")
+	parser.add_argument("--rounds", type=int, default=ROUNDS, help="rounds of the timings, of which the best of each is kept")
+	parser.add_argument("--large-size", type=int, default=50 * 1024 * 1024, help="bytes in the large body")
+	parser.add_argument("--save", help="write the results to this file")
+	parser.add_argument("--compare", help="compare the results against this baseline")
+	parser.add_argument("--tolerance", type=float, default=0.5, help="how much worse than the baseline is a regression")
+	args = parser.parse_args()
+
+	# downloads go outside the source tree, and are cleaned up after
+	with tempfile.TemporaryDirectory(prefix="bench_http.") as scratch, StandInServer() as server:
+		timings = [
+			{
+				"overhead_ms": overhead(server.base, args.calls),
+				"throughput_rps": throughput(server.base, args.calls, args.concurrency),
+				}
+			for _ in range(args.rounds)
+			]
+		results = {**best_of(timings), "memory_mb": memory(server.base, args.large_size, scratch)}
+
+	for kind, measurements in results.items():
+		print(kind)
+		for name, value in measurements.items():
+			print(f"  {name:24} {value:10.2f}")
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+			f.write("\n")
+
+	if args.compare:
+		with open(args.compare) as f:
+			regressions = compare(results, json.load(f), args.tolerance)
+		for regression in regressions:
+			print(f"REGRESSION {regression}", file=sys.stderr)
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,69 @@
+"""
+A local stand-in for the HTTP APIs the plugins talk to, so benchmarks don't depend on the network
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SMALL = json.dumps({"authenticated": True, "token": "hihello"}).encode("utf-8")
+
+
+class Handler(BaseHTTPRequestHandler):
+	# keep-alive, like most real APIs
+	protocol_version = "HTTP/1.1"
+	# send the headers and small bodies together, otherwise Nagle and delayed ACKs add 40ms to every call
+	disable_nagle_algorithm = True
+	wbufsize = 64 * 1024
+	bodies = {}
+
+	def do_GET(self):
+		url = urlsplit(self.path)
+		if url.path == "/large":
+			size = int(parse_qs(url.query).get("size", ["1048576"])[0])
+			self.respond(self.large(size), "application/json")
+		else:
+			self.respond(SMALL, "application/json")
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		self.respond(SMALL, "application/json")
+
+	def respond(self, body: bytes, content_type: str):
+		self.send_response(200)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	@classmethod
+	def large(cls, size: int) -> bytes:
+		""" A JSON document of `size` bytes, since both plugins decode JSON bodies """
+		if size not in cls.bodies:
+			cls.bodies[size] = b'"' + b"x" * (size - 2) + b'"'
+		return cls.bodies[size]
+
+	def log_message(self, format, *args):
+		pass
+
+
+class StandInServer(object):
+	""" Serves the stand-in API from a background thread """
+
+	def __init__(self):
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.server.daemon_threads = True
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+	@property
+	def base(self) -> str:
+		return "http://127.0.0.1:%d" % self.server.server_port
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.server.shutdown()
+		self.server.server_close()
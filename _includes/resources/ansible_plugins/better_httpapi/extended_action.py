@@ -0,0 +1,2042 @@
+import atexit
+import base64
+import fcntl
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import random
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import partial
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, Mapping, Optional, List, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import requests
+from ansible.errors import AnsibleError
+from ansible.plugins.action import ActionBase
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.auth import HTTPBasicAuth, AuthBase
+from requests.structures import CaseInsensitiveDict
+from requests.utils import DEFAULT_ACCEPT_ENCODING, get_encoding_from_headers, select_proxy
+from urllib3 import HTTPConnectionPool, HTTPResponse, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import NewConnectionError, ProtocolError, ReadTimeoutError
+
+try:
+	import jmespath
+
+	HAS_JMESPATH = True
+except ImportError:
+	HAS_JMESPATH = False
+
+try:
+	import zstandard
+
+	HAS_ZSTANDARD = True
+except ImportError:
+	HAS_ZSTANDARD = False
+
+try:
+	import httpx
+
+	HAS_HTTPX = True
+except ImportError:
+	HAS_HTTPX = False
+
+try:
+	import ijson
+
+	HAS_IJSON = True
+except ImportError:
+	HAS_IJSON = False
+
+try:
+	import brotli
+
+	HAS_BROTLI = True
+except ImportError:
+	HAS_BROTLI = False
+
+NS = "lilatomic_api_http"
+AUTHORIZATION_HEADER = "Authorization"
+DEFAULT_TIMEOUT = 15
+DEFAULT_POOL_SIZE = 10
+DEFAULT_SESSION_TTL = 300
+MAX_SESSIONS = 32
+DEFAULT_MAX_CONCURRENCY = 10
+TRANSPORTS = ("requests", "httpx")
+UNIX_SCHEME = "unix://"
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# small, since every item parsed out of a chunk is held until the chunk is done
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_CHECKSUM_ALGORITHM = "sha256"
+DEFAULT_CACHE_PATH = "~/.cache/lilatomic_api_http"
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+DEFAULT_STATE_PATH = "~/.cache/lilatomic_api_http/state"
+DEFAULT_SHARED_TTL = 60
+# long enough for forks queued on the lock to read a failure, short enough that later tasks try again
+SHARED_FAILURE_TTL = 5
+
+DEFAULT_TOKEN_REFRESH_MARGIN = 60
+# connection kwargs which apply to fetching OAuth2 tokens, as opposed to describing the API's requests
+TOKEN_SEND_KWARGS = ("verify", "cert", "proxies", "timeout")
+
+DEFAULT_RETRY_STATUSES = (429, 502, 503, 504)
+DEFAULT_RETRY_EXCEPTIONS = ("ConnectionError", "Timeout")
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+DEFAULT_CIRCUIT_THRESHOLD = 5
+DEFAULT_CIRCUIT_RESET = 30
+
+# kwargs which describe the request, as opposed to how it is sent
+REQUEST_FIELDS = ("headers", "files", "data", "params", "auth", "cookies", "hooks", "json")
+# request headers which can change the representation a server responds with
+CACHE_KEY_HEADERS = ("Accept", "Accept-Encoding", "Accept-Language", AUTHORIZATION_HEADER)
+# cached and recorded bodies are already decoded, so these headers no longer describe them
+DECODED_SKIPPED_HEADERS = ("Content-Encoding", "Content-Length", "Transfer-Encoding")
+
+# Content-Encodings we can compress request bodies with, and the library each needs
+COMPRESSORS = {
+	# no timestamp in the gzip header, so the same body always compresses the same way
+	"gzip": (True, "", lambda body: gzip.compress(body, mtime=0)),
+	"deflate": (True, "", lambda body: zlib.compress(body)),
+	"zstd": (HAS_ZSTANDARD, "zstandard", lambda body: zstandard.ZstdCompressor().compress(body)),
+	"br": (HAS_BROTLI, "brotli", lambda body: brotli.compress(body)),
+	}
+
+# urllib3 decodes most Content-Encodings itself, but only recent versions of it can decode zstd
+FALLBACK_DECODERS = {}
+if HAS_ZSTANDARD and "zstd" not in HTTPResponse.CONTENT_DECODERS:
+	FALLBACK_DECODERS["zstd"] = lambda: zstandard.ZstdDecompressor().decompressobj()
+ACCEPT_ENCODING = ", ".join([DEFAULT_ACCEPT_ENCODING] + list(FALLBACK_DECODERS))
+
+# result fields kept regardless of `return_fields`
+ALWAYS_RETURNED = {"failed", "extracted", "timing"}
+CASSETTE_MODES = ("record", "replay")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# the phases of a request reported by `timing`, in order
+TIMING_PHASES = ("dns", "connect", "tls", "ttfb", "transfer", "decode", "total")
+
+# task args which configure a batch, rather than the requests in it
+BULK_ARGS = {"connection", "requests", "max_concurrency"}
+
+
+class HTTPBearerAuth(AuthBase):
+	def __init__(self, token, header=AUTHORIZATION_HEADER, value_format="Bearer {}"):
+		self.token = token
+		self.header = header
+		self.value_format = value_format
+
+	def __call__(self, r):
+		r.headers[self.header] = self.value_format.format(self.token)
+		return r
+
+
+class OAuth2ClientCredentialsAuth(AuthBase):
+	""" Bearer auth with a token from an OAuth2 client credentials grant
+
+	Tokens are cached in memory and in a state file keyed by the token URL, client and scope, so every task and fork shares one token.
+	A token is refreshed `refresh_margin` seconds before it expires, and dropped if a request with it is answered with a 401.
+	Tokens are fetched through the session of the request being authenticated, with the connection's TLS, proxy and timeout settings in `send_kwargs`.
+	"""
+
+	def __init__(self, token_url, client_id, client_secret, scope=None, audience=None, client_auth="basic",
+			refresh_margin=DEFAULT_TOKEN_REFRESH_MARGIN, path=DEFAULT_STATE_PATH, header=AUTHORIZATION_HEADER, value_format="Bearer {}",
+			send_kwargs=None):
+		self.token_url = token_url
+		self.client_id = client_id
+		self.client_secret = client_secret
+		self.scope = " ".join(scope) if isinstance(scope, list) else scope
+		self.audience = audience
+		self.client_auth = client_auth
+		self.refresh_margin = float(refresh_margin)
+		self.header = header
+		self.value_format = value_format
+		self.send_kwargs = send_kwargs or {"timeout": DEFAULT_TIMEOUT}
+		self.key = hashlib.sha256(json.dumps([token_url, client_id, self.scope, audience]).encode("utf-8")).hexdigest()
+		self.state_file = os.path.join(os.path.expanduser(path), f"token.{self.key}.json")
+
+	def __call__(self, r, session: Optional[requests.Session] = None):
+		token = self.token(session)
+		r.headers[self.header] = self.value_format.format(token)
+		r.register_hook("response", partial(self.revoked, token))
+		return r
+
+	def token(self, session: Optional[requests.Session] = None) -> str:
+		with TOKENS_LOCK:
+			cached = TOKENS.get(self.key)
+			if self.fresh(cached):
+				return cached["access_token"]
+
+			# holding the file lock while fetching means only one fork asks the identity provider
+			with locked_state(self.state_file) as state:
+				if not self.fresh(state):
+					state.clear()
+					state.update(self.fetch(session))
+				TOKENS[self.key] = dict(state)
+			return TOKENS[self.key]["access_token"]
+
+	def fresh(self, token: Optional[Dict]) -> bool:
+		return bool(token) and token.get("expires_at", 0) - self.refresh_margin > time.time()
+
+	def revoked(self, token: str, r: Response, **kwargs) -> Response:
+		""" Response hook which drops the token if it was refused, so the next request fetches another instead of reusing it until it expires """
+		if r.status_code == 401:
+			with TOKENS_LOCK:
+				# another request may already have replaced it
+				if TOKENS.get(self.key, {}).get("access_token") == token:
+					del TOKENS[self.key]
+				with locked_state(self.state_file) as state:
+					if state.get("access_token") == token:
+						state.clear()
+		return r
+
+	def fetch(self, session: Optional[requests.Session] = None) -> Dict:
+		data = {"grant_type": "client_credentials"}
+		if self.scope:
+			data["scope"] = self.scope
+		if self.audience:
+			data["audience"] = self.audience
+
+		if self.client_auth == "body":
+			data.update({"client_id": self.client_id, "client_secret": self.client_secret})
+			auth = None
+		else:
+			auth = HTTPBasicAuth(self.client_id, self.client_secret)
+
+		r = (session or requests).post(self.token_url, data=data, auth=auth, **self.send_kwargs)
+		if not r.ok:
+			raise AnsibleError(f"could not get an OAuth2 token from {self.token_url}: {r.status_code} {r.reason} {r.text}")
+		token = r.json()
+		return {
+			"access_token": token["access_token"],
+			# tokens without an expiry are treated as short-lived
+			"expires_at": time.time() + float(token.get("expires_in", self.refresh_margin * 2)),
+			}
+
+
+TOKENS: Dict[str, Dict] = {}
+TOKENS_LOCK = threading.Lock()
+
+
+# the timing record of the request being sent on this thread, if it asked for timing
+PHASES = threading.local()
+
+
+class TimedConnection(object):
+	""" Records how long it took to resolve and connect, if the request being sent wants to know """
+
+	def _new_conn(self):
+		record = getattr(PHASES, "record", None)
+		if record is None:
+			return super()._new_conn()
+
+		start = time.perf_counter()
+		try:
+			addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+		except socket.gaierror:
+			# let urllib3 raise its own error for it
+			return super()._new_conn()
+		resolved = time.perf_counter()
+
+		# connect to the addresses we resolved, instead of resolving them again
+		host = self._dns_host
+		try:
+			for i, (_, _, _, _, sockaddr) in enumerate(addresses):
+				self._dns_host = sockaddr[0]
+				try:
+					conn = super()._new_conn()
+					break
+				except NewConnectionError:
+					if i == len(addresses) - 1:
+						raise
+		finally:
+			self._dns_host = host
+
+		record["dns"] = resolved - start
+		record["connect"] = time.perf_counter() - resolved
+		return conn
+
+
+class TimedHTTPConnection(TimedConnection, HTTPConnection):
+	pass
+
+
+class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+	def connect(self):
+		start = time.perf_counter()
+		super().connect()
+		record = getattr(PHASES, "record", None)
+		if record is not None:
+			record["tls"] = time.perf_counter() - start - record["dns"] - record["connect"]
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+	ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+	ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+	def init_poolmanager(self, *args, **kwargs):
+		super().init_poolmanager(*args, **kwargs)
+		self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+class UnixSocketConnection(HTTPConnection):
+	""" HTTP over a Unix domain socket, for APIs of local daemons """
+
+	def __init__(self, *args, socket_path: str, **kwargs):
+		self.socket_path = socket_path
+		super().__init__(*args, **kwargs)
+
+	def _new_conn(self) -> socket.socket:
+		start = time.perf_counter()
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		# urllib3 uses a sentinel for "no timeout given"
+		sock.settimeout(self.timeout if isinstance(self.timeout, (int, float)) else None)
+		try:
+			sock.connect(self.socket_path)
+		except OSError as e:
+			sock.close()
+			raise NewConnectionError(self, f"Failed to connect to {self.socket_path}: {e}") from e
+
+		record = getattr(PHASES, "record", None)
+		if record is not None:
+			record["connect"] = time.perf_counter() - start
+		return sock
+
+
+class UnixSocketConnectionPool(HTTPConnectionPool):
+	ConnectionCls = UnixSocketConnection
+
+
+class UnixSocketAdapter(HTTPAdapter):
+	""" Sends every request to one Unix socket, whatever its host, keeping a pool of connections to it """
+
+	def __init__(self, socket_path: str, **kwargs):
+		# set before `HTTPAdapter.__init__`, which builds the pool manager
+		self.socket_path = socket_path
+		super().__init__(**kwargs)
+
+	def init_poolmanager(self, *args, **kwargs):
+		super().init_poolmanager(*args, **kwargs)
+		# the pool passes extra kwargs through to its connections
+		self.poolmanager.pool_classes_by_scheme = {"http": partial(UnixSocketConnectionPool, socket_path=self.socket_path)}
+
+
+class HTTPXAdapter(BaseAdapter):
+	""" Transport adapter which sends requests with httpx, so they can be multiplexed over HTTP/2
+
+	Concurrent requests to one origin (bulk requests, prefetched pages) share a single HTTP/2 connection, instead of each taking a connection from the pool.
+	httpx configures TLS and proxies per client, so there is a client for each combination of them.
+	"""
+
+	def __init__(self, pool_size=DEFAULT_POOL_SIZE, http2=True):
+		super().__init__()
+		self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+		self.http2 = http2
+		self._clients: Dict[Tuple, "httpx.Client"] = {}
+		self._lock = threading.Lock()
+
+	def send(self, request: PreparedRequest, stream=False, timeout=None, verify=True, cert=None, proxies=None) -> Response:
+		client = self.client(verify, cert, select_proxy(request.url, proxies or {}))
+		extensions = {}
+		record = getattr(PHASES, "record", None)
+		if record is not None:
+			extensions["trace"] = partial(self.trace, record, {})
+		outgoing = client.build_request(
+			request.method, request.url, headers=dict(request.headers), content=request.body, timeout=self.timeout(timeout), extensions=extensions
+			)
+		try:
+			incoming = client.send(outgoing, stream=True)
+		except httpx.TimeoutException as e:
+			raise requests.Timeout(e, request=request)
+		except httpx.TransportError as e:
+			raise requests.ConnectionError(e, request=request)
+
+		r = Response()
+		r.status_code = incoming.status_code
+		r.reason = incoming.reason_phrase
+		for name, value in incoming.headers.multi_items():
+			r.headers[name] = f"{r.headers[name]}, {value}" if name in r.headers else value
+		r.encoding = get_encoding_from_headers(r.headers)
+		r.url = request.url
+		r.request = request
+		r.connection = self
+		r.raw = HTTPXRaw(incoming)
+		for name, value in incoming.cookies.items():
+			r.cookies.set(name, value)
+		return r
+
+	def client(self, verify, cert, proxy) -> "httpx.Client":
+		key = (verify, cert if not isinstance(cert, list) else tuple(cert), proxy)
+		with self._lock:
+			if key not in self._clients:
+				# the client outlives tasks, so it must not keep cookies; the requests session handles them per task
+				self._clients[key] = httpx.Client(
+					http2=self.http2, limits=self.limits, verify=verify, cert=cert, proxy=proxy, trust_env=False,
+					cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+					)
+			return self._clients[key]
+
+	@staticmethod
+	def trace(record: Dict, started: Dict, event: str, info: Dict):
+		""" httpcore trace callback, which records connection phases. httpcore resolves names as part of connecting """
+		name, _, state = event.rpartition(".")
+		if state == "started":
+			started[name] = time.perf_counter()
+		elif state == "complete" and name in started:
+			if name == "connection.connect_tcp":
+				record["connect"] = time.perf_counter() - started[name]
+			elif name == "connection.start_tls":
+				record["tls"] = time.perf_counter() - started[name]
+
+	@staticmethod
+	def timeout(timeout) -> "httpx.Timeout":
+		if isinstance(timeout, (tuple, list)):
+			connect, read = timeout
+			return httpx.Timeout(read, connect=connect)
+		return httpx.Timeout(timeout)
+
+	def close(self):
+		with self._lock:
+			for client in self._clients.values():
+				try:
+					client.close()
+				except httpx.TransportError:
+					# the server already dropped the connection
+					pass
+			self._clients.clear()
+
+
+class HTTPXRaw(object):
+	""" Just enough of a urllib3 response for requests to read an httpx response's body """
+
+	def __init__(self, response: "httpx.Response"):
+		self._response = response
+		self.version = response.http_version
+
+	def stream(self, amt=None, decode_content=True):
+		# raised as urllib3 would, so requests reports a broken body the same way for both transports
+		try:
+			if decode_content:
+				yield from self._response.iter_bytes(amt)
+			else:
+				yield from self._response.iter_raw(amt)
+		except httpx.TransportError as e:
+			raise ProtocolError(e)
+
+	def read(self, amt=None, decode_content=True) -> bytes:
+		return self._response.read()
+
+	def close(self):
+		self._response.close()
+
+	def release_conn(self):
+		self._response.close()
+
+
+class ConnectionInfo(object):
+	""" A connection definition compiled into everything its tasks need
+
+	Compiling builds the auth, cache, retry policy and so on, and merges the default request kwargs.
+	Use `ConnectionInfo.compile` so this happens once per definition in each worker.
+	Profiles are shared by every task and thread using the connection, so nothing may change them once built.
+	"""
+
+	def __init__(self, connection_name: str, base, auth=None, kwargs=None, pool_size=DEFAULT_POOL_SIZE, session_ttl=DEFAULT_SESSION_TTL,
+			cache=None, retry=None, circuit_breaker=None, rate_limit=None, transport="requests", http2=True, har=None, cassette=None):
+		if transport not in TRANSPORTS:
+			raise AnsibleError(f"unknown transport `{transport}`, expected one of {', '.join(TRANSPORTS)}")
+		if transport == "httpx" and not HAS_HTTPX:
+			raise AnsibleError("the httpx transport requires the httpx library, install it with `pip install httpx[http2]`")
+		self.key = definition_key(base=base, auth=auth, kwargs=kwargs, pool_size=pool_size, transport=transport, http2=http2)
+		if base.startswith(UNIX_SCHEME):
+			if transport != "requests":
+				raise AnsibleError(f"connections to a Unix socket use the requests transport, not `{transport}`")
+			self.socket_path = base[len(UNIX_SCHEME):]
+			# requests needs an HTTP URL, but the host doesn't matter since every request goes to the socket
+			self.base = "http://localhost"
+		else:
+			self.socket_path = None
+			self.base = base
+		# tasks merge their own kwargs over these, copying only what they change
+		self.kwargs = MappingProxyType({"timeout": DEFAULT_TIMEOUT, **(kwargs or {})})
+		self.auth = self.make_auth(auth, self.kwargs)
+		self.pool_size = int(pool_size)
+		self.session_ttl = float(session_ttl)
+		self.cache = ResponseCache(**cache, socket_path=self.socket_path) if cache else None
+		self.retry = MappingProxyType(retry or {})
+		self.retry_policy = RetryPolicy(**self.retry)
+		self.breaker = CircuitBreaker(connection_name, **circuit_breaker) if circuit_breaker else None
+		self.limiter = RateLimiter(connection_name, **rate_limit) if rate_limit else None
+		self.transport = transport
+		self.http2 = http2
+		self.har = HarWriter(**har) if har else None
+		self.cassette = Cassette(**cassette, socket_path=self.socket_path) if cassette else None
+
+	@classmethod
+	def compile(cls, connection_name: str, definition: Dict) -> "ConnectionInfo":
+		""" The profile for a connection definition, compiling it the first time this worker sees it """
+		key = definition_key(connection_name=connection_name, **definition)
+		with PROFILES_LOCK:
+			if key in PROFILES:
+				PROFILES.move_to_end(key)
+				return PROFILES[key]
+
+		profile = cls(connection_name, **definition)
+		with PROFILES_LOCK:
+			# another thread may have compiled it meanwhile, keep theirs so everyone shares one
+			profile = PROFILES.setdefault(key, profile)
+			while len(PROFILES) > MAX_SESSIONS:
+				PROFILES.popitem(last=False)
+		return profile
+
+	def make_session(self) -> requests.Session:
+		session = requests.Session()
+		if self.socket_path:
+			session.mount("http://", UnixSocketAdapter(self.socket_path, pool_connections=1, pool_maxsize=self.pool_size))
+			# proxies from the environment would take requests for `localhost` away from the socket
+			session.trust_env = False
+		else:
+			if self.transport == "httpx":
+				adapter = HTTPXAdapter(pool_size=self.pool_size, http2=self.http2)
+			else:
+				adapter = TimedHTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+			session.mount("http://", adapter)
+			session.mount("https://", adapter)
+		session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+		session.hooks["response"].append(decode_fallback_encodings)
+		# cookies belong to a single request, don't leak them to other tasks sharing the session
+		session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+		return session
+
+	@staticmethod
+	def make_auth(params, kwargs: Mapping) -> Optional[AuthBase]:
+		if params is None or params == {}:
+			return None
+		auth_method = params.get("method", "basic")
+		# the definition comes from task vars, so don't consume the method out of it
+		params = {k: v for k, v in params.items() if k != "method"}
+		if auth_method == "basic":
+			return HTTPBasicAuth(params["username"], params["password"])
+		elif auth_method == "bearer":
+			return HTTPBearerAuth(**params)
+		elif auth_method == "oauth2_client_credentials":
+			# the identity provider may need the same TLS and proxy settings as the API
+			send_kwargs = {k: v for k, v in kwargs.items() if k in TOKEN_SEND_KWARGS}
+			return OAuth2ClientCredentialsAuth(**params, send_kwargs=send_kwargs)
+		else:
+			return None
+
+
+PROFILES: "OrderedDict[str, ConnectionInfo]" = OrderedDict()
+PROFILES_LOCK = threading.Lock()
+
+
+class ResponseCache(object):
+	""" On-disk cache of GET responses, revalidated with their ETag or Last-Modified validators
+
+	The cache is a directory, so entries are shared by all forks on the controller.
+	The least recently used entries are evicted once the bodies take up more than `max_size` bytes.
+	Requests to a Unix socket all have the same host, so the socket is part of their key.
+	"""
+
+	def __init__(self, path=DEFAULT_CACHE_PATH, max_size=DEFAULT_CACHE_SIZE, socket_path=None):
+		self.path = os.path.expanduser(path)
+		self.max_size = int(max_size)
+		self.socket_path = socket_path
+		os.makedirs(self.path, exist_ok=True)
+
+	def key(self, request: PreparedRequest) -> str:
+		relevant = [request.method, request.url] + [request.headers.get(h) for h in CACHE_KEY_HEADERS]
+		if self.socket_path:
+			relevant.append(self.socket_path)
+		return hashlib.sha256(json.dumps(relevant).encode("utf-8")).hexdigest()
+
+	def load(self, key: str) -> Optional[Dict]:
+		try:
+			with open(self._file(key, "json"), "r") as f:
+				entry = json.load(f)
+			with open(self._file(key, "body"), "rb") as f:
+				entry["content"] = f.read()
+		except (OSError, ValueError):
+			return None
+		# the access time drives LRU eviction
+		os.utime(self._file(key, "body"))
+		return entry
+
+	@staticmethod
+	def conditional_headers(entry: Dict) -> Dict:
+		# stored as the server sent them, and httpx lowercases them
+		stored = CaseInsensitiveDict(entry["headers"])
+		headers = {}
+		if stored.get("ETag"):
+			headers["If-None-Match"] = stored["ETag"]
+		if stored.get("Last-Modified"):
+			headers["If-Modified-Since"] = stored["Last-Modified"]
+		return headers
+
+	@staticmethod
+	def cacheable(response: Response) -> bool:
+		has_validator = "ETag" in response.headers or "Last-Modified" in response.headers
+		return response.status_code == 200 and has_validator and "no-store" not in response.headers.get("Cache-Control", "")
+
+	def store(self, key: str, response: Response):
+		entry = {
+			"status_code": response.status_code,
+			"reason": response.reason,
+			"url": response.url,
+			"encoding": response.encoding,
+			"headers": decoded_headers(response.headers),
+			}
+		# the body goes first, so an entry with metadata always has a body
+		self._write(self._file(key, "body"), response.content)
+		self._write(self._file(key, "json"), json.dumps(entry).encode("utf-8"))
+		self._evict()
+
+	@staticmethod
+	def rebuild(entry: Dict, not_modified: Response) -> Response:
+		""" Make the cached response look like it came from the 304 """
+		r = Response()
+		r._content = entry["content"]
+		r.status_code = entry["status_code"]
+		r.reason = entry["reason"]
+		r.url = entry["url"]
+		r.encoding = entry["encoding"]
+		r.headers.update(entry["headers"])
+		# a 304 carries fresh values for the headers it includes
+		r.headers.update(not_modified.headers)
+		# entries stored before these were dropped may still have them
+		for header in DECODED_SKIPPED_HEADERS:
+			r.headers.pop(header, None)
+		r.headers["Content-Length"] = str(len(r._content))
+		r.cookies = not_modified.cookies
+		r.elapsed = not_modified.elapsed
+		r.request = not_modified.request
+		r.connection = not_modified.connection
+		r.from_cache = True
+		return r
+
+	def _file(self, key: str, kind: str) -> str:
+		return os.path.join(self.path, f"{key}.{kind}")
+
+	def _write(self, path: str, content: bytes):
+		# write-and-rename, so other forks never read a partial file
+		fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+		with os.fdopen(fd, "wb") as f:
+			f.write(content)
+		os.replace(tmp, path)
+
+	def _evict(self):
+		bodies = []
+		for entry in os.scandir(self.path):
+			if entry.name.endswith(".body"):
+				stat = entry.stat()
+				bodies.append((stat.st_mtime, stat.st_size, entry.name[:-len(".body")]))
+		total = sum(size for _, size, _ in bodies)
+		for _, size, key in sorted(bodies):
+			if total <= self.max_size:
+				break
+			for kind in ("json", "body"):
+				try:
+					os.remove(self._file(key, kind))
+				except FileNotFoundError:
+					pass
+			total -= size
+
+
+class DecodedRaw(object):
+	""" Wraps a urllib3 response to decode a Content-Encoding urllib3 can't, as the body is streamed """
+
+	def __init__(self, raw, decoder):
+		self._raw = raw
+		self._decoder = decoder
+
+	def stream(self, amt=None, decode_content=True):
+		for chunk in self._raw.stream(amt, decode_content=decode_content):
+			yield self._decoder.decompress(chunk) if decode_content else chunk
+
+	def __getattr__(self, name):
+		return getattr(self._raw, name)
+
+
+class CircuitOpenError(requests.RequestException):
+	pass
+
+
+class CassetteMissError(requests.RequestException):
+	pass
+
+
+class RetryPolicy(object):
+	""" Which failures to retry, and how long to wait between attempts
+
+	Waits are exponential with full jitter, unless the response says how long to wait with Retry-After.
+	No wait is longer than `max_backoff`.
+	"""
+
+	def __init__(self, attempts=1, backoff=0.5, max_backoff=30, statuses=DEFAULT_RETRY_STATUSES, exceptions=DEFAULT_RETRY_EXCEPTIONS,
+			methods=IDEMPOTENT_METHODS):
+		self.attempts = int(attempts)
+		self.backoff = float(backoff)
+		self.max_backoff = float(max_backoff)
+		self.statuses = set(statuses)
+		self.exceptions = tuple(getattr(requests.exceptions, name) for name in exceptions)
+		self.methods = {m.upper() for m in methods}
+
+	def retryable(self, method: str, attempt: int) -> bool:
+		return attempt < self.attempts and method in self.methods
+
+	def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+		asked = parse_retry_after(retry_after)
+		if asked is not None:
+			return min(self.max_backoff, asked)
+		return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker(object):
+	""" Fails requests to a connection fast while its upstream is down
+
+	The breaker opens after `threshold` consecutive failed requests, and lets requests through again after `reset_after` seconds.
+	If the first one fails, it opens again straight away.
+	The state is kept in a file, so every fork sees the same breaker.
+	"""
+
+	def __init__(self, connection_name: str, threshold=DEFAULT_CIRCUIT_THRESHOLD, reset_after=DEFAULT_CIRCUIT_RESET, path=DEFAULT_STATE_PATH):
+		self.connection_name = connection_name
+		self.threshold = int(threshold)
+		self.reset_after = float(reset_after)
+		self.state_file = os.path.join(os.path.expanduser(path), f"circuit.{connection_name}.json")
+
+	def check(self):
+		with locked_state(self.state_file) as state:
+			if state.get("open_until", 0) > time.time():
+				raise CircuitOpenError(
+					f"circuit breaker for connection `{self.connection_name}` is open after {state['failures']} consecutive failures"
+					)
+
+	def record(self, success: bool):
+		with locked_state(self.state_file) as state:
+			if success:
+				state.update({"failures": 0, "open_until": 0})
+			else:
+				state["failures"] = state.get("failures", 0) + 1
+				if state["failures"] >= self.threshold:
+					state["open_until"] = time.time() + self.reset_after
+
+
+class RateLimiter(object):
+	""" Token bucket shared by every fork making requests to a connection
+
+	The bucket holds up to `burst` tokens and refills at `rate` tokens per second; each request takes one.
+	Requests reserve their token even if the bucket is empty, and then wait outside the lock until it would have refilled.
+	This spaces out waiting forks instead of having them all retry at once.
+	"""
+
+	def __init__(self, connection_name: str, rate, burst=None, path=DEFAULT_STATE_PATH):
+		self.rate = float(rate)
+		self.burst = float(burst) if burst else max(1.0, self.rate)
+		self.state_file = os.path.join(os.path.expanduser(path), f"rate.{connection_name}.json")
+
+	def acquire(self):
+		with locked_state(self.state_file) as state:
+			now = time.time()
+			elapsed = max(0.0, now - state.get("updated", now))
+			tokens = min(self.burst, state.get("tokens", self.burst) + elapsed * self.rate) - 1
+			state.update({"tokens": tokens, "updated": now})
+		if tokens < 0:
+			time.sleep(-tokens / self.rate)
+
+
+class Pagination(object):
+	""" How to find the next page of a paginated response
+
+	- `link` follows the `rel="next"` URL in the Link header
+	- `cursor` reads the next cursor from `cursor_path` in the body and sends it as the `cursor_param` query parameter
+	- `page` counts the `page_param` query parameter up from `start` by `step`; use the item offset and page size for offset pagination
+
+	The items of each page are the list at `items` in the body, or the body itself if it is a list; pagination stops at a page without any.
+	"""
+
+	def __init__(self, style="link", items=None, cursor_path=None, cursor_param="cursor", page_param="page", start=1, step=1,
+			max_pages=None, prefetch=0, dest=None):
+		if style not in ("link", "cursor", "page"):
+			raise AnsibleError(f"unknown pagination style `{style}`, expected one of link, cursor or page")
+		if style == "cursor" and not cursor_path:
+			raise AnsibleError("cursor pagination requires `cursor_path`")
+		self.style = style
+		self.items = items
+		self.cursor_path = cursor_path
+		self.cursor_param = cursor_param
+		self.page_param = page_param
+		self.start = int(start)
+		self.step = int(step)
+		self.max_pages = int(max_pages) if max_pages else None
+		# only page numbers are known before the previous page arrives
+		self.prefetch = int(prefetch) if style == "page" else 0
+		self.dest = os.path.expanduser(dest) if dest else None
+
+	def page_items(self, document) -> List:
+		if not self.items and not isinstance(document, list):
+			raise AnsibleError(f"the page's body is a {type(document).__name__}, set `items` to the path of its list of items")
+		found = dig(document, self.items)
+		if found is None:
+			return []
+		# anything else would page forever, as it is never empty
+		if not isinstance(found, list):
+			raise AnsibleError(f"the items at `{self.items}` are a {type(found).__name__}, not a list")
+		return found
+
+	def page_args(self, args: Dict, number: int) -> Dict:
+		return with_params(args, {self.page_param: self.start + number * self.step})
+
+	def next_args(self, args: Dict, r: Response, document) -> Optional[Dict]:
+		""" Args for the page after `r`, or None for the last page """
+		if self.style == "link":
+			url = r.links.get("next", {}).get("url")
+			if not url:
+				return None
+			# the link already carries the query
+			next_args = {**args, "path": url}
+			next_args["kwargs"] = {k: v for k, v in args.get("kwargs", {}).items() if k != "params"}
+			return next_args
+		elif self.style == "cursor":
+			cursor = dig(document, self.cursor_path)
+			if not cursor or cursor == args.get("kwargs", {}).get("params", {}).get(self.cursor_param):
+				return None
+			return with_params(args, {self.cursor_param: cursor})
+		return None
+
+
+class ItemStream(object):
+	""" Items picked out of a JSON body as it arrives, so only the items being kept are ever in memory
+
+	The items are found at `path`, a dotted path where `*` is each element of an array, like `data.items.*`.
+	Items are kept if the JMESPath expression `filter` is truthy for them, up to `limit` of them.
+	"""
+
+	def __init__(self, path, filter=None, limit=None, dest=None):
+		if not HAS_IJSON:
+			raise AnsibleError("the `stream_items` option requires the ijson library, install it with `pip install ijson`")
+		if filter and not HAS_JMESPATH:
+			raise AnsibleError("the `filter` of `stream_items` requires the jmespath library, install it with `pip install jmespath`")
+		# ijson calls array elements `item`
+		self.prefix = ".".join("item" if part == "*" else part for part in path.split(".")) if path else ""
+		self.filter = jmespath.compile(filter) if filter else None
+		self.limit = int(limit) if limit else None
+		self.dest = os.path.expanduser(dest) if dest else None
+
+	def items(self, r: Response) -> Iterator[Any]:
+		parsed = ijson.sendable_list()
+		parser = ijson.items_coro(parsed, self.prefix, use_float=True)
+		for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+			parser.send(chunk)
+			yield from parsed
+			del parsed[:]
+		parser.close()
+		yield from parsed
+
+	def matching(self, r: Response) -> Iterator[Any]:
+		items = self.items(r)
+		if self.filter:
+			items = (item for item in items if self.filter.search(item))
+		return itertools.islice(items, self.limit)
+
+	def collect(self, r: Response) -> Dict:
+		""" Read the matching items off the response, into the result or into `dest` """
+		items = []
+		item_count = 0
+		start = time.monotonic()
+		dest = open(self.dest, "w") if self.dest else None
+		try:
+			for item in self.matching(r):
+				item_count += 1
+				if dest:
+					dest.write(json.dumps(item) + "\n")
+				else:
+					items.append(item)
+		finally:
+			# past the limit, the rest of the body isn't wanted
+			r.close()
+			if dest:
+				dest.close()
+
+		out = {"item_count": item_count, "stream_time": time.monotonic() - start}
+		if dest:
+			out["dest"] = self.dest
+		else:
+			out["items"] = items
+		return out
+
+
+class WaitCondition(object):
+	""" When polling is done, and how long to wait between polls
+
+	Polling is done once the status is one of `status` (by default, any acceptable status)
+	and, if `path` is set, the value at that dotted path in the JSON body is `value` (or truthy, without a `value`).
+	The wait between polls starts at `delay` and grows by `backoff` each poll up to `max_delay`, unless the response asks for a Retry-After.
+	"""
+
+	def __init__(self, status=None, path=None, value=None, timeout=300, delay=1, max_delay=30, backoff=1.5):
+		self.status = [int(code) for code in status] if status else None
+		self.path = path
+		self.value = value
+		self.timeout = float(timeout)
+		self.delay = float(delay)
+		self.max_delay = float(max_delay)
+		self.backoff = float(backoff)
+
+	def met(self, r: Response, acceptable: bool) -> bool:
+		if not (r.status_code in self.status if self.status else acceptable):
+			return False
+		if not self.path:
+			return True
+		try:
+			found = dig(r.json(), self.path)
+		except ValueError:
+			return False
+		return bool(found) if self.value is None else found == self.value
+
+	def next_delay(self, delay: Optional[float], r: Response) -> float:
+		""" The wait after `r`, given the last wait, or None before the first """
+		asked = parse_retry_after(r.headers.get("Retry-After"))
+		if asked is not None:
+			return asked
+		if delay is None:
+			return self.delay
+		# a short Retry-After, even of 0, doesn't reset the backoff
+		return min(self.max_delay, max(delay, self.delay) * self.backoff)
+
+
+class Segments(object):
+	""" A download split into byte ranges, each fetched into its own part file so it can be resumed
+
+	A part file's length is how much of its range has arrived, so an interrupted download picks up where each range stopped.
+	The parts are only reused if the size and validator (ETag or Last-Modified) of the resource haven't changed.
+	"""
+
+	def __init__(self, dest: str, count: int, size: int, validator: Optional[str]):
+		self.dest = os.path.expanduser(dest)
+		self.size = size
+		self.validator = validator
+		count = max(1, min(count, size))
+		bounds = [size * i // count for i in range(count + 1)]
+		# inclusive, like the Range header
+		self.ranges = [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
+
+	def part(self, index: int) -> str:
+		return f"{self.dest}.part{index}"
+
+	@property
+	def manifest(self) -> str:
+		return f"{self.dest}.parts.json"
+
+	def prepare(self) -> int:
+		""" Start or resume the parts, returning how many bytes were already downloaded """
+		# parts are the bytes as sent, so parts decoded by earlier versions aren't resumed
+		expected = {"size": self.size, "validator": self.validator, "ranges": self.ranges, "encoding": "identity"}
+		try:
+			with open(self.manifest, "r") as f:
+				resumable = self.validator is not None and json.load(f) == json.loads(json.dumps(expected))
+		except (OSError, ValueError):
+			resumable = False
+		if not resumable:
+			self.discard()
+			with open(self.manifest, "w") as f:
+				json.dump(expected, f)
+		return sum(self.done(i) for i in range(len(self.ranges)))
+
+	def done(self, index: int) -> int:
+		try:
+			return os.path.getsize(self.part(index))
+		except OSError:
+			return 0
+
+	def remaining(self, index: int) -> Optional[str]:
+		""" The Range header for what's left of a part, or None if it's complete """
+		first, last = self.ranges[index]
+		start = first + self.done(index)
+		return f"bytes={start}-{last}" if start <= last else None
+
+	def complete(self) -> bool:
+		return all(self.done(i) == last - first + 1 for i, (first, last) in enumerate(self.ranges))
+
+	def chunks(self) -> Iterator[bytes]:
+		for i in range(len(self.ranges)):
+			with open(self.part(i), "rb") as f:
+				yield from iter(partial(f.read, DEFAULT_CHUNK_SIZE), b"")
+
+	def discard(self):
+		for path in [self.manifest] + [self.part(i) for i in range(len(self.ranges))]:
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+
+
+class HarWriter(object):
+	""" Records requests and responses into a HAR (HTTP Archive) file shared by every fork
+
+	Entries are buffered for the whole task, then appended in one write under a lock by overwriting the closing brackets of the file.
+	The file is valid HAR between writes, and forks only wait on each other for the length of a write.
+	The Authorization header is censored unless `log_auth` is set, and bodies are only recorded with `bodies`.
+	"""
+
+	HEAD = json.dumps({"log": {"version": "1.2", "creator": {"name": "lilatomic.api.http", "version": "0.1.0"}, "pages": []}})[:-2] + ', "entries": [\n'
+	TAIL = "\n]}}\n"
+
+	def __init__(self, path, log_auth=False, bodies=False):
+		self.path = os.path.expanduser(path)
+		self.log_auth = log_auth
+		self.bodies = bodies
+		self._entries: List[str] = []
+		self._lock = threading.Lock()
+
+	def add(self, r: Response):
+		entries = [json.dumps(self.entry(response)) for response in r.history + [r]]
+		with self._lock:
+			self._entries.extend(entries)
+
+	def entry(self, r: Response) -> Dict:
+		req = r.request
+		timing = getattr(r, "timing", {})
+		elapsed = r.elapsed.total_seconds()
+		entry = {
+			"startedDateTime": datetime.fromtimestamp(time.time() - elapsed, timezone.utc).isoformat(),
+			"time": 1000 * timing.get("total", elapsed),
+			"request": {
+				"method": req.method,
+				"url": req.url,
+				"httpVersion": http_version(r),
+				"cookies": [],
+				"headers": self.headers(censor(req.headers, self.log_auth)),
+				"queryString": [{"name": k, "value": v} for k, v in parse_qsl(urlsplit(req.url).query)],
+				"headersSize": -1,
+				"bodySize": len(req.body) if isinstance(req.body, (bytes, str)) else -1,
+				},
+			"response": {
+				"status": r.status_code,
+				"statusText": r.reason,
+				"httpVersion": http_version(r),
+				"cookies": [{"name": k, "value": v} for k, v in r.cookies.items()],
+				"headers": self.headers(r.headers),
+				"content": {
+					"size": len(r.content) if r._content_consumed else -1,
+					"mimeType": r.headers.get("Content-Type", ""),
+					},
+				"redirectURL": r.headers.get("Location", ""),
+				"headersSize": -1,
+				"bodySize": -1,
+				},
+			"cache": {},
+			"timings": {
+				"blocked": -1,
+				"dns": 1000 * timing.get("dns", -0.001),
+				"connect": 1000 * timing.get("connect", -0.001),
+				"ssl": 1000 * timing.get("tls", -0.001),
+				"send": 0,
+				"wait": 1000 * timing.get("ttfb", elapsed),
+				"receive": 1000 * timing.get("transfer", 0),
+				},
+			}
+		if self.bodies:
+			if req.body is not None:
+				body = req.body.decode("utf-8", "replace") if isinstance(req.body, bytes) else str(req.body)
+				entry["request"]["postData"] = {"mimeType": req.headers.get("Content-Type", ""), "text": body}
+			if r._content_consumed:
+				entry["response"]["content"]["text"] = r.text
+		return entry
+
+	@staticmethod
+	def headers(headers) -> List[Dict]:
+		return [{"name": k, "value": v} for k, v in headers.items()]
+
+	def flush(self):
+		with self._lock:
+			entries, self._entries = self._entries, []
+		if not entries:
+			return
+
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), "r+b") as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			try:
+				size = f.seek(0, os.SEEK_END)
+				if size == 0:
+					f.write(self.HEAD.encode("utf-8"))
+					separator = ""
+				else:
+					f.seek(size - len(self.TAIL))
+					separator = "" if size == len(self.HEAD) + len(self.TAIL) else ",\n"
+				f.write((separator + ",\n".join(entries) + self.TAIL).encode("utf-8"))
+				f.flush()
+			finally:
+				fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Cassette(object):
+	""" Responses saved to a file, so requests can be answered again without the network
+
+	In `record` mode, each response is appended to the file as a JSON line under a lock, so forks can record together.
+	In `replay` mode, requests are answered from the file, and a request which wasn't recorded fails.
+	Requests match on their method, normalised URL and a hash of their body, and on the socket for a Unix socket.
+	A request recorded more than once is answered with its responses in order, repeating the last one.
+	"""
+
+	def __init__(self, path, mode="replay", socket_path=None):
+		if mode not in CASSETTE_MODES:
+			raise AnsibleError(f"unknown cassette mode `{mode}`, expected one of {', '.join(CASSETTE_MODES)}")
+		self.path = os.path.expanduser(path)
+		self.mode = mode
+		self.socket_path = socket_path
+		self._recorded: Optional[Dict[str, List[Dict]]] = None
+		self._played: Dict[str, int] = {}
+		self._lock = threading.Lock()
+
+	@property
+	def replaying(self) -> bool:
+		return self.mode == "replay"
+
+	def key(self, request: PreparedRequest) -> str:
+		body = request.body.encode("utf-8") if isinstance(request.body, str) else request.body
+		body_hash = hashlib.sha256(body).hexdigest() if isinstance(body, bytes) else ""
+		relevant = [request.method, normalize_url(request.url), body_hash]
+		if self.socket_path:
+			relevant.append(self.socket_path)
+		return hashlib.sha256(json.dumps(relevant).encode("utf-8")).hexdigest()
+
+	def recording(self, transmit, request: PreparedRequest) -> Response:
+		""" Send the request, and record its response """
+		r = transmit()
+		entry = {
+			"key": self.key(request),
+			"method": request.method,
+			"url": r.url,
+			"status_code": r.status_code,
+			"reason": r.reason,
+			"encoding": r.encoding,
+			"headers": decoded_headers(r.headers),
+			"body": base64.b64encode(r.content).decode("ascii"),
+			}
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		with os.fdopen(os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), "ab") as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			try:
+				f.write((json.dumps(entry) + "\n").encode("utf-8"))
+				f.flush()
+			finally:
+				fcntl.flock(f, fcntl.LOCK_UN)
+		return r
+
+	def replay(self, request: PreparedRequest) -> Response:
+		key = self.key(request)
+		with self._lock:
+			if self._recorded is None:
+				self._recorded = self.load()
+			entries = self._recorded.get(key)
+			if not entries:
+				raise CassetteMissError(f"no response to {request.method} {request.url} was recorded in the cassette {self.path}", request=request)
+			played = self._played.get(key, 0)
+			self._played[key] = played + 1
+		entry = entries[min(played, len(entries) - 1)]
+
+		r = Response()
+		r._content = base64.b64decode(entry["body"])
+		r._content_consumed = True
+		r.status_code = entry["status_code"]
+		r.reason = entry["reason"]
+		r.url = entry["url"]
+		r.encoding = entry["encoding"]
+		r.headers.update(entry["headers"])
+		r.headers["Content-Length"] = str(len(r._content))
+		r.request = request
+		r.elapsed = timedelta(0)
+		return r
+
+	def load(self) -> Dict[str, List[Dict]]:
+		recorded = {}
+		try:
+			with open(self.path, "r") as f:
+				for line in f:
+					entry = json.loads(line)
+					recorded.setdefault(entry["key"], []).append(entry)
+		except FileNotFoundError:
+			raise AnsibleError(f"the cassette {self.path} doesn't exist, record it first with `mode: record`")
+		return recorded
+
+
+class SessionRegistry(object):
+	""" Keep-alive sessions shared by every request made in this worker process
+
+	Sessions are keyed by the connection name and its definition, so a changed definition gets a fresh session.
+	A session is closed once it is older than its connection's `session_ttl`, or when it is the least recently used one past `max_sessions`.
+	"""
+
+	def __init__(self, max_sessions=MAX_SESSIONS):
+		self.max_sessions = max_sessions
+		self._sessions: "OrderedDict[Tuple[str, str], Tuple[float, requests.Session]]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, connection_name: str, connection_info: ConnectionInfo) -> requests.Session:
+		key = (connection_name, connection_info.key)
+		now = time.monotonic()
+		with self._lock:
+			self._expire(now)
+			if key in self._sessions:
+				self._sessions.move_to_end(key)
+				return self._sessions[key][1]
+
+			session = connection_info.make_session()
+			self._sessions[key] = (now + connection_info.session_ttl, session)
+			while len(self._sessions) > self.max_sessions:
+				_, (_, evicted) = self._sessions.popitem(last=False)
+				evicted.close()
+			return session
+
+	def evict(self, connection_name: str):
+		with self._lock:
+			for key in [k for k in self._sessions if k[0] == connection_name]:
+				self._sessions.pop(key)[1].close()
+
+	def close(self):
+		with self._lock:
+			while self._sessions:
+				_, (_, session) = self._sessions.popitem()
+				session.close()
+
+	def _expire(self, now: float):
+		for key in [k for k, (expires, _) in self._sessions.items() if expires <= now]:
+			self._sessions.pop(key)[1].close()
+
+
+SESSIONS = SessionRegistry()
+atexit.register(SESSIONS.close)
+
+
+class ActionModule(ActionBase):
+	def run(self, tmp=None, task_vars=None):
+		super().run(tmp=tmp, task_vars=task_vars)
+
+		connection_name = self.arg("connection")
+		connection_info = ConnectionInfo.compile(connection_name, task_vars[NS][connection_name])
+		session = SESSIONS.get(connection_name, connection_info)
+
+		# a replayed connection never reaches the upstream these protect
+		replaying = connection_info.cassette and connection_info.cassette.replaying
+		self.breaker = None if replaying else connection_info.breaker
+		self.limiter = None if replaying else connection_info.limiter
+
+		try:
+			return self.make_requests(connection_name, session, connection_info)
+		finally:
+			if connection_info.har:
+				connection_info.har.flush()
+
+	def make_requests(self, connection_name: str, session: requests.Session, connection_info: ConnectionInfo) -> Dict:
+		bulk = self.arg_or("requests")
+		if bulk is None:
+			return summarise_page_timings(connection_name, self.request_or_fail(session, connection_info, self._task.args))
+
+		# task-level args are defaults for every request in the batch
+		defaults = {k: v for k, v in self._task.args.items() if k not in BULK_ARGS}
+		max_concurrency = int(self.arg_or("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+
+		# `map` yields in input order, regardless of completion order
+		with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+			results = list(executor.map(lambda item: self.request_or_fail(session, connection_info, {**defaults, **item}), bulk))
+
+		out = {
+			"failed": any(result["failed"] for result in results),
+			"results": results,
+			}
+		if self.arg_or("timing"):
+			# paginated requests are merged page by page
+			timings = [result["timing"] if isinstance(result["timing"], list) else [result["timing"]] for result in results if "timing" in result]
+			out["timing"] = aggregate_timings(connection_name, list(itertools.chain.from_iterable(timings)))
+		for result in results:
+			summarise_page_timings(connection_name, result)
+		return out
+
+	def request_or_fail(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict) -> Dict:
+		""" Report requests which couldn't complete as failed, rather than as an exception """
+		try:
+			if args.get("shared"):
+				return self.shared_request(session, connection_info, args)
+			return self.request(session, connection_info, args)
+		except requests.RequestException as e:
+			return {"failed": True, "msg": f"{type(e).__name__}: {e}"}
+
+	def shared_request(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict) -> Dict:
+		""" Make a GET once for every fork making it, and share the result
+
+		The first fork to take the lock makes the request, and the others wait on the lock and then read its result.
+		Successful results are reused for `shared_ttl` seconds, so later batches of hosts share them too.
+		Failed results are kept for a few seconds, so forks already waiting on the lock fail with it instead of each retrying in turn.
+		Results are stored in `shared_path`, where expired ones are pruned whenever a new one is stored.
+		"""
+		if args.get("method", "GET").upper() != "GET":
+			raise AnsibleError("`shared` is only for GET requests")
+		key = definition_key(connection=connection_info.key, args={k: v for k, v in args.items() if k not in ("shared_ttl", "shared_path")})
+		path = os.path.join(os.path.expanduser(args.get("shared_path") or DEFAULT_STATE_PATH), f"shared.{key}")
+		ttl = float(args.get("shared_ttl", DEFAULT_SHARED_TTL))
+
+		# most forks arrive after the result is ready, and don't need to queue on the lock to read it
+		out = load_shared(path, ttl)
+		if out is None:
+			with exclusive_lock(path + ".lock"):
+				out = load_shared(path, ttl)
+				if out is None:
+					out = self.request(session, connection_info, args)
+					store_shared(path, out, SHARED_FAILURE_TTL if out["failed"] else ttl)
+					out["coalesced"] = False
+					return out
+		out["coalesced"] = True
+		return out
+
+	def request(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict) -> Dict:
+		if args.get("paginate"):
+			return self.paginate(session, connection_info, args)
+		if args.get("wait_for"):
+			return self.wait_for(session, connection_info, args)
+		if args.get("dest") and int(args.get("segments", 1)) > 1:
+			return self.segmented_download(session, connection_info, args)
+
+		r = self.send(session, connection_info, args)
+		return self.result(r, args)
+
+	def send(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict) -> Response:
+		task_kwargs = args.get("kwargs", {})
+
+		method = args.get("method", "GET")
+		data = args.get("data")
+		json = args.get("json")
+
+		headers = args.get("headers")
+
+		request_kwargs = recursive_merge(connection_info.kwargs, task_kwargs)
+		if headers:
+			request_kwargs = recursive_merge(request_kwargs, {"headers": headers})
+		if "timeout" in args:
+			request_kwargs["timeout"] = args["timeout"]
+
+		cassette = connection_info.cassette
+		# replayed requests don't match on their credentials, so don't fetch any, like an OAuth2 token
+		auth = None if cassette and cassette.replaying else connection_info.auth
+		if isinstance(auth, OAuth2ClientCredentialsAuth) and not connection_info.socket_path:
+			# tokens come through the session's transport; a Unix socket's session would send them to the socket
+			auth = partial(auth, session=session)
+		prepared, send_kwargs = prepare(session, method, urljoin(connection_info.base + '/', args["path"].strip("/")),
+			auth=auth, data=data, json=json, **request_kwargs)
+
+		if args.get("compress"):
+			compress_body(prepared, args["compress"], int(args.get("compress_min_size", DEFAULT_COMPRESS_MIN_SIZE)))
+
+		if cassette and cassette.replaying:
+			transmit = partial(cassette.replay, prepared)
+		elif args.get("dest") or args.get("stream_items"):
+			# downloads and streamed items are read off the socket as they are used, so the body never sits in memory or the cache
+			send_kwargs["stream"] = True
+			transmit = partial(session.send, prepared, **send_kwargs)
+		elif connection_info.cache and args.get("cache", True) and prepared.method == "GET":
+			transmit = partial(self.send_cached, session, connection_info.cache, prepared, send_kwargs)
+		else:
+			transmit = partial(session.send, prepared, **send_kwargs)
+
+		if cassette and not cassette.replaying:
+			transmit = partial(cassette.recording, transmit, prepared)
+
+		if args.get("timing") or connection_info.har:
+			transmit = partial(timed, transmit)
+
+		policy = RetryPolicy(**recursive_merge(connection_info.retry, args["retry"])) if args.get("retry") else connection_info.retry_policy
+		r = self.send_with_retries(transmit, prepared.method, policy)
+		if connection_info.har:
+			connection_info.har.add(r)
+		return r
+
+	def send_with_retries(self, transmit, method: str, policy: RetryPolicy) -> Response:
+		if self.breaker:
+			self.breaker.check()
+
+		for attempt in itertools.count(1):
+			if self.limiter:
+				self.limiter.acquire()
+			try:
+				r = transmit()
+			except policy.exceptions:
+				if not policy.retryable(method, attempt):
+					if self.breaker:
+						self.breaker.record(success=False)
+					raise
+				delay = policy.delay(attempt)
+			else:
+				if r.status_code not in policy.statuses or not policy.retryable(method, attempt):
+					if self.breaker:
+						self.breaker.record(success=r.status_code < 500)
+					r.attempts = attempt
+					return r
+				delay = policy.delay(attempt, r.headers.get("Retry-After"))
+				r.close()
+			time.sleep(delay)
+
+	def paginate(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict) -> Dict:
+		pagination = Pagination(**args["paginate"])
+		args = {k: v for k, v in args.items() if k != "paginate"}
+
+		items = []
+		timings = []
+		item_count = 0
+		pages = 0
+		out = {"failed": False}
+		dest = open(pagination.dest, "w") if pagination.dest else None
+		try:
+			for r, document in self.pages(session, connection_info, args, pagination):
+				pages += 1
+				if document is None:
+					# report the page which failed
+					out = self.result(r, args)
+					break
+
+				page_items = pagination.page_items(document)
+				if args.get("timing") and hasattr(r, "timing"):
+					timings.append(r.timing)
+				item_count += len(page_items)
+				if dest:
+					for item in page_items:
+						dest.write(json.dumps(item) + "\n")
+				else:
+					items.extend(page_items)
+				out.update({"status": r.status_code, "url": r.url})
+		finally:
+			if dest:
+				dest.close()
+
+		out.update({"pages": pages, "item_count": item_count})
+		if timings:
+			# summarised by `make_requests`, which can merge them with those of other requests
+			out["timing"] = timings
+		if dest:
+			out["dest"] = pagination.dest
+		else:
+			out["items"] = items
+		return out
+
+	def wait_for(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict) -> Dict:
+		""" Poll until the condition is met or the time is up, returning the last response """
+		condition = WaitCondition(**args["wait_for"])
+		args = {k: v for k, v in args.items() if k != "wait_for"}
+
+		start = time.monotonic()
+		deadline = start + condition.timeout
+		delay = None
+		for polls in itertools.count(1):
+			r = self.send(session, connection_info, args)
+			met = condition.met(r, self.is_ok(r, args.get("status_code")))
+			if met:
+				break
+			# the wait after this response, which may ask for its own with Retry-After
+			delay = condition.next_delay(delay, r)
+			if time.monotonic() + delay > deadline:
+				break
+			r.close()
+			time.sleep(delay)
+
+		out = self.result(r, args)
+		# waiting for a status, like a 404 once something is deleted, succeeds even if that status isn't otherwise acceptable
+		out.update({"failed": not met, "polls": polls, "wait_time": time.monotonic() - start})
+		if not met:
+			out["msg"] = f"the wait_for condition was not met after {polls} polls in {out['wait_time']:.1f} seconds"
+		return out
+
+	def segmented_download(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict) -> Dict:
+		""" Download `dest` as several byte ranges at once, resuming any parts left by an interrupted download """
+		# ranges index the bytes as sent, so ask for them unencoded, or each range would be decoded on its own
+		identity = {**(args.get("headers") or {}), "Accept-Encoding": "identity"}
+		head = self.send(session, connection_info, {**args, "method": "HEAD", "headers": identity})
+		# reading the (empty) body hands the connection back to the pool
+		head.content
+		size = int(head.headers.get("Content-Length") or -1)
+		if not self.is_ok(head, args.get("status_code")) or head.headers.get("Accept-Ranges") != "bytes" or size <= 0 or is_encoded(head):
+			# the server can't do ranges, or only of an encoded body, so fall back to one stream
+			return self.result(self.send(session, connection_info, args), args)
+
+		# If-Range only takes strong validators
+		etag = head.headers.get("ETag")
+		validator = etag if etag and not etag.startswith("W/") else head.headers.get("Last-Modified")
+		segments = Segments(args["dest"], int(args["segments"]), size, validator)
+		resumed = segments.prepare()
+
+		def fetch(index: int) -> Optional[Dict]:
+			""" Append the rest of a part, returning why it couldn't be, if it couldn't """
+			byte_range = segments.remaining(index)
+			if not byte_range:
+				return None
+			headers = {**identity, "Range": byte_range}
+			if validator:
+				# a changed resource comes back whole, rather than as a range of the new version
+				headers["If-Range"] = validator
+			r = self.send(session, connection_info, {**args, "headers": headers})
+			try:
+				if r.status_code != 206:
+					return {"status": r.status_code, "url": r.url, "msg": f"expected 206 Partial Content for every range, got {r.status_code}"}
+				content_range = r.headers.get("Content-Range", "")
+				# a Range of `bytes=0-99` comes back as a Content-Range of `bytes 0-99/1000`
+				if not content_range.startswith(byte_range.replace("=", " ", 1) + "/"):
+					return {"status": r.status_code, "url": r.url, "msg": f"asked for {byte_range}, got {content_range or 'no Content-Range'}"}
+				if is_encoded(r):
+					# the parts would hold the encoded body, which one stream would have decoded
+					return {"encoded": True}
+				with open(segments.part(index), "ab") as f:
+					for chunk in raw_chunks(r):
+						f.write(chunk)
+			finally:
+				r.close()
+			return None
+
+		start = time.monotonic()
+		with ThreadPoolExecutor(max_workers=len(segments.ranges)) as executor:
+			unexpected = [problem for problem in executor.map(fetch, range(len(segments.ranges))) if problem is not None]
+
+		if unexpected:
+			# the parts can't be trusted if the resource changed under them
+			segments.discard()
+			if all(problem.get("encoded") for problem in unexpected):
+				return self.result(self.send(session, connection_info, args), args)
+			return {"failed": True, **next(problem for problem in unexpected if not problem.get("encoded"))}
+		if not segments.complete():
+			return {"failed": True, "msg": f"the download of {segments.dest} is incomplete, run the task again to resume it"}
+
+		out = self.result(head, {k: v for k, v in args.items() if k != "dest"})
+		out.update(write_verified(args["dest"], segments.chunks(), args.get("checksum_algorithm", DEFAULT_CHECKSUM_ALGORITHM), args.get("expected_checksum")))
+		out.update({"segments": len(segments.ranges), "resumed_size": resumed, "download_time": time.monotonic() - start})
+		segments.discard()
+		return out
+
+	def pages(self, session: requests.Session, connection_info: ConnectionInfo, args: Dict, pagination: Pagination) -> Iterator[Tuple[Response, Any]]:
+		""" Each page's response and decoded body in order, stopping after a page which failed or has no items """
+
+		def decode(r: Response):
+			return r.json() if self.is_ok(r, args.get("status_code")) else None
+
+		def last(document) -> bool:
+			return document is None or not pagination.page_items(document)
+
+		numbers = iter(range(pagination.max_pages)) if pagination.max_pages else itertools.count()
+
+		if pagination.prefetch:
+			with ThreadPoolExecutor(max_workers=pagination.prefetch + 1) as executor:
+				def fetch(number: int):
+					return executor.submit(self.send, session, connection_info, pagination.page_args(args, number))
+
+				in_flight = deque(fetch(n) for n in itertools.islice(numbers, pagination.prefetch + 1))
+				while in_flight:
+					r = in_flight.popleft().result()
+					document = decode(r)
+					yield r, document
+					if last(document):
+						for pending in in_flight:
+							pending.cancel()
+						return
+					in_flight.extend(fetch(n) for n in itertools.islice(numbers, 1))
+			return
+
+		page_args = args
+		for number in numbers:
+			if pagination.style == "page":
+				page_args = pagination.page_args(args, number)
+			r = self.send(session, connection_info, page_args)
+			document = decode(r)
+			yield r, document
+			if last(document):
+				return
+			if pagination.style != "page":
+				page_args = pagination.next_args(page_args, r, document)
+				if page_args is None:
+					return
+
+	def result(self, r: Response, args: Dict) -> Dict:
+		dest = args.get("dest")
+		out = {}
+		fields = args.get("return_fields")
+
+		def wanted(field: str) -> bool:
+			return fields is None or field in fields
+
+		# response status
+		out["failed"] = not self.is_ok(r, args.get("status_code"))
+
+		# response data
+		if dest and not out["failed"]:
+			out.update(download(r, dest, args.get("checksum_algorithm", DEFAULT_CHECKSUM_ALGORITHM), args.get("expected_checksum")))
+		elif args.get("stream_items") and not out["failed"]:
+			out.update(ItemStream(**args["stream_items"]).collect(r))
+		else:
+			# decoding is the expensive part, so only decode what will be returned
+			is_json = r.headers.get("Content-Type", None) == "application/json"
+			extract = args.get("extract")
+			if extract or (is_json and wanted("json")):
+				decode_start = time.perf_counter()
+				document = r.json()
+				if args.get("timing") and hasattr(r, "timing"):
+					r.timing["decode"] = time.perf_counter() - decode_start
+				if is_json and wanted("json"):
+					out["json"] = document
+				if extract:
+					out["extracted"] = jmespath_search(extract, document)
+			if wanted("msg"):
+				out["msg"] = r.text
+			if wanted("content"):
+				out["content"] = r.content
+
+		# parameters for ansible.legacy.uri module
+		out.update({
+			"content_length": r.headers.get("Content-Length", None),
+			"content_type": r.headers.get("Content-Type", None),
+			"cookies": dict(r.cookies),
+			"date": r.headers.get("Date", None),
+			"elapsed": r.elapsed.seconds,
+			"redirected": r.is_redirect,
+			"server": r.headers.get("Server", None),
+			"status": r.status_code,
+			"url": r.url,
+			})
+
+		# other parameters
+		out.update({
+			"encoding": r.encoding,
+			"headers": r.headers,
+			"reason": r.reason,
+			"status_code": r.status_code,
+			})
+		if hasattr(r, "from_cache"):
+			out["cached"] = r.from_cache
+		if args.get("timing") and hasattr(r, "timing"):
+			transfer_time = out.get("download_time", out.get("stream_time"))
+			if transfer_time is not None:
+				r.timing["transfer"] = transfer_time
+				r.timing["total"] += transfer_time
+			r.timing["total"] += r.timing["decode"]
+			out["timing"] = r.timing
+		if getattr(r, "attempts", 1) > 1:
+			out["attempts"] = r.attempts
+
+		# request parameters, for debugging
+		if args.get("log_request"):
+			req = r.request
+			headers = censor(req.headers, args.get("log_auth"))
+
+			out.update({
+				"request": {
+					"body": req.body,
+					"headers": headers,
+					"method": req.method,
+					"path_url": req.path_url,
+					"url": req.url,
+					}
+				})
+
+		if fields is not None:
+			out = {k: v for k, v in out.items() if k in fields or k in ALWAYS_RETURNED}
+
+		return out
+
+	@staticmethod
+	def send_cached(session: requests.Session, cache: ResponseCache, prepared: PreparedRequest, send_kwargs: Dict) -> Response:
+		key = cache.key(prepared)
+		entry = cache.load(key)
+		if entry:
+			prepared.headers.update(cache.conditional_headers(entry))
+
+		r = session.send(prepared, **send_kwargs)
+		if entry and r.status_code == 304:
+			return cache.rebuild(entry, r)
+		if cache.cacheable(r):
+			cache.store(key, r)
+		r.from_cache = False
+		return r
+
+	@staticmethod
+	def is_ok(response: Response, acceptable_codes: Optional[List[int]] = None):
+		if acceptable_codes:
+			return response.status_code in acceptable_codes
+		else:
+			return response.ok
+
+	@staticmethod
+	def parse_content_length(content_length: Optional[str]) -> Optional[int]:
+		if content_length:
+			try:
+				return int(content_length)
+			except ValueError:
+				return None
+		return None
+
+	def arg(self, arg):
+		return self._task.args[arg]
+
+	def arg_or(self, arg, default=None):
+		return self._task.args.get(arg, default)
+
+
+def prepare(session: requests.Session, method: str, url: str, **kwargs) -> Tuple[PreparedRequest, Dict]:
+	""" Split `requests.request` style kwargs into a prepared request and the kwargs for sending it
+
+	This is what `Session.request` does, but keeping the prepared request lets us look at it before it is sent.
+	"""
+	request = requests.Request(method, url, **{k: kwargs.pop(k) for k in REQUEST_FIELDS if k in kwargs})
+	prepared = session.prepare_request(request)
+	settings = session.merge_environment_settings(
+		prepared.url, kwargs.pop("proxies", None) or {}, kwargs.pop("stream", None), kwargs.pop("verify", None), kwargs.pop("cert", None)
+		)
+	return prepared, {**kwargs, **settings}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+	""" Seconds to wait from a Retry-After header, which is either a number of seconds or a date """
+	if not value:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		try:
+			return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+		except (TypeError, ValueError):
+			return None
+
+
+def download(response: Response, dest: str, checksum_algorithm: str, expected_checksum: Optional[str] = None) -> Dict:
+	""" Stream a response body into a file, a chunk at a time """
+	try:
+		return write_verified(dest, response.iter_content(chunk_size=DEFAULT_CHUNK_SIZE), checksum_algorithm, expected_checksum)
+	finally:
+		response.close()
+
+
+def is_encoded(response: Response) -> bool:
+	""" Whether the body was sent with a Content-Encoding, despite asking for it unencoded """
+	return response.headers.get("Content-Encoding", "identity").strip().lower() not in ("", "identity")
+
+
+def raw_chunks(response: Response) -> Iterator[bytes]:
+	""" The body as it was sent, without decoding its Content-Encoding """
+	if response._content_consumed:
+		# replayed or cached, so it is all in memory already
+		yield response.content
+	else:
+		# raised as requests would from `iter_content`, so they are reported as failed requests
+		try:
+			yield from response.raw.stream(DEFAULT_CHUNK_SIZE, decode_content=False)
+		except ProtocolError as e:
+			raise requests.exceptions.ChunkedEncodingError(e)
+		except ReadTimeoutError as e:
+			raise requests.exceptions.ConnectionError(e)
+
+
+def write_verified(dest: str, chunks: Iterator[bytes], checksum_algorithm: str, expected_checksum: Optional[str] = None) -> Dict:
+	""" Write chunks to a file, only replacing it if they are complete and match the expected checksum """
+	dest = os.path.expanduser(dest)
+	checksum = hashlib.new(checksum_algorithm)
+	size = 0
+	start = time.monotonic()
+
+	# write-and-rename, so an interrupted download never looks complete
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)), suffix=".part")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			for chunk in chunks:
+				f.write(chunk)
+				checksum.update(chunk)
+				size += len(chunk)
+		out = {
+			"dest": dest,
+			"size": size,
+			"checksum": checksum.hexdigest(),
+			"checksum_algorithm": checksum_algorithm,
+			"download_time": time.monotonic() - start,
+			}
+		if expected_checksum and out["checksum"] != expected_checksum.lower():
+			os.remove(tmp)
+			out.update({"failed": True, "msg": f"the {checksum_algorithm} checksum of the download is {out['checksum']}, expected {expected_checksum}"})
+		else:
+			os.replace(tmp, dest)
+	except BaseException:
+		os.remove(tmp)
+		raise
+	return out
+
+
+def timed(transmit) -> Response:
+	""" Send a request, recording how long each phase took in `response.timing` """
+	PHASES.record = record = {phase: 0.0 for phase in TIMING_PHASES}
+	start = time.perf_counter()
+	try:
+		r = transmit()
+	finally:
+		PHASES.record = None
+	total = time.perf_counter() - start
+
+	# requests measures `elapsed` from sending until the headers are parsed, and reads the body after that
+	setup = record["dns"] + record["connect"] + record["tls"]
+	elapsed = r.elapsed.total_seconds()
+	record.update({
+		"connection_reused": setup == 0,
+		"ttfb": max(0.0, elapsed - setup),
+		"transfer": max(0.0, total - elapsed),
+		"total": total,
+		})
+	r.timing = record
+	return r
+
+
+def aggregate_timings(connection_name: str, timings: List[Dict]) -> Dict:
+	""" Summarise the timing of many requests to a connection """
+	summary = {"connection": connection_name, "requests": len(timings), "connections_opened": sum(not t["connection_reused"] for t in timings)}
+	for phase in TIMING_PHASES:
+		values = sorted(t[phase] for t in timings)
+		if values:
+			summary[phase] = {
+				"total": sum(values),
+				"mean": sum(values) / len(values),
+				"p50": values[len(values) // 2],
+				"p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+				"max": values[-1],
+				}
+	return summary
+
+
+def summarise_page_timings(connection_name: str, out: Dict) -> Dict:
+	""" Replace the timings of each page of a paginated request with their summary """
+	if isinstance(out.get("timing"), list):
+		out["timing"] = aggregate_timings(connection_name, out["timing"])
+	return out
+
+
+def decoded_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+	""" Response headers which still describe the body once it is decoded """
+	skipped = {header.lower() for header in DECODED_SKIPPED_HEADERS}
+	return {k: v for k, v in headers.items() if k.lower() not in skipped}
+
+
+def http_version(r: Response) -> str:
+	version = getattr(r.raw, "version", None)
+	if isinstance(version, str):
+		return version
+	return {10: "HTTP/1.0", 11: "HTTP/1.1", 20: "HTTP/2"}.get(version, "HTTP/1.1")
+
+
+def normalize_url(url: str) -> str:
+	""" The URL with its scheme and host lowercased, default port dropped and query sorted, so equivalent URLs compare equal """
+	parts = urlsplit(url)
+	scheme = parts.scheme.lower()
+	host = parts.hostname or ""
+	if ":" in host:
+		host = f"[{host}]"
+	if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+		host += f":{parts.port}"
+	query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+	return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def censor(headers, log_auth: bool = False):
+	""" Copy of request headers with the Authorization header hidden, unless `log_auth` """
+	headers = headers.copy()
+	if not log_auth:
+		if AUTHORIZATION_HEADER in headers:
+			headers[AUTHORIZATION_HEADER] = "*" * len(headers[AUTHORIZATION_HEADER])
+	return headers
+
+
+def decode_fallback_encodings(r: Response, **kwargs) -> Response:
+	""" Response hook which decodes bodies in the encodings in FALLBACK_DECODERS """
+	encoding = r.headers.get("Content-Encoding", "").strip().lower()
+	if encoding in FALLBACK_DECODERS and isinstance(r.raw, HTTPResponse):
+		r.raw = DecodedRaw(r.raw, FALLBACK_DECODERS[encoding]())
+	return r
+
+
+def compress_body(prepared: PreparedRequest, encoding: str, min_size: int):
+	""" Compress the body of a prepared request in place, if it's big enough to be worth it """
+	if encoding not in COMPRESSORS:
+		raise AnsibleError(f"cannot compress with `{encoding}`, expected one of {', '.join(COMPRESSORS)}")
+	available, library, compress = COMPRESSORS[encoding]
+	if not available:
+		raise AnsibleError(f"compressing with `{encoding}` requires the {library} library, install it with `pip install {library}`")
+
+	body = prepared.body
+	if isinstance(body, str):
+		body = body.encode("utf-8")
+	# streamed bodies (files, generators) are sent as they are
+	if not isinstance(body, bytes) or len(body) < min_size:
+		return
+
+	prepared.body = compress(body)
+	prepared.headers["Content-Encoding"] = encoding
+	prepared.headers["Content-Length"] = str(len(prepared.body))
+
+
+def jmespath_search(expression: str, document):
+	if not HAS_JMESPATH:
+		raise AnsibleError("the `extract` option requires the jmespath library, install it with `pip install jmespath`")
+	return jmespath.search(expression, document)
+
+
+@contextmanager
+def locked_state(path: str) -> Iterator[Dict]:
+	""" Read, modify and write back a small JSON state file, holding an exclusive lock so forks take turns """
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	# state can include credentials, so only we can read it
+	with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+") as f:
+		fcntl.flock(f, fcntl.LOCK_EX)
+		try:
+			f.seek(0)
+			try:
+				state = json.loads(f.read() or "{}")
+			except ValueError:
+				state = {}
+			yield state
+			f.seek(0)
+			f.truncate()
+			f.write(json.dumps(state))
+			f.flush()
+		finally:
+			fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def exclusive_lock(path: str) -> Iterator[None]:
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+") as f:
+		fcntl.flock(f, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_shared(path: str, ttl: float) -> Optional[Dict]:
+	""" A result stored by `store_shared`, if it is younger than `ttl` seconds, or than SHARED_FAILURE_TTL if it failed """
+	try:
+		age = time.time() - os.stat(path).st_mtime
+		if age > ttl:
+			return None
+		with open(path, "rb") as f:
+			float(f.readline())
+			out = pickle.load(f)
+	except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+		return None
+	if out.get("failed") and age > SHARED_FAILURE_TTL:
+		return None
+	return out
+
+
+def store_shared(path: str, out: Dict, ttl: float):
+	""" Store a result for `load_shared`, after a line with when it expires, and prune the expired ones """
+	# pickled, since results hold bytes and header dicts which JSON would change.
+	# Only we can read or write the file, like the rest of the state
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(f"{time.time() + ttl}\n".encode("ascii"))
+			pickle.dump(out, f)
+		os.replace(tmp, path)
+	except BaseException:
+		os.remove(tmp)
+		raise
+	prune_shared(os.path.dirname(path))
+
+
+def prune_shared(directory: str):
+	""" Remove expired shared results, and the locks of those no fork is holding """
+	now = time.time()
+	for name in os.listdir(directory):
+		if not name.startswith("shared.") or name.endswith(".lock"):
+			continue
+		path = os.path.join(directory, name)
+		try:
+			with open(path, "rb") as f:
+				expires_at = float(f.readline())
+		except FileNotFoundError:
+			continue
+		except (OSError, ValueError):
+			# stored without an expiry by an earlier version
+			expires_at = 0
+		if expires_at < now:
+			with suppress(FileNotFoundError):
+				os.remove(path)
+
+	for name in os.listdir(directory):
+		if not (name.startswith("shared.") and name.endswith(".lock")) or os.path.exists(os.path.join(directory, name[:-len(".lock")])):
+			continue
+		path = os.path.join(directory, name)
+		try:
+			with open(path, "r") as f:
+				# a fork holding the lock is making the request
+				fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				os.remove(path)
+		except OSError:
+			continue
+
+
+def dig(document, path: Optional[str]) -> Any:
+	""" Follow a dotted path like `data.items` or `results.0.id` into a document, returning None if it isn't there """
+	if not path:
+		return document
+	for part in path.split("."):
+		if isinstance(document, dict):
+			document = document.get(part)
+		elif isinstance(document, list) and part.lstrip("-").isdigit() and -len(document) <= int(part) < len(document):
+			document = document[int(part)]
+		else:
+			return None
+	return document
+
+
+def with_params(args: Dict, params: Dict) -> Dict:
+	""" Copy of task args with extra query parameters """
+	return {**args, "kwargs": recursive_merge(args.get("kwargs", {}), {"params": params})}
+
+
+def definition_key(**definition) -> str:
+	""" Stable digest of a connection definition, so secrets aren't kept around as dict keys """
+	return hashlib.sha256(json.dumps(definition, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def recursive_merge(a: Mapping, b: Mapping, path=None) -> Dict:
+	""" Recursively merges dictionaries
+	Mostly taken from user `andrew cooke` on [stackoverflow](https://stackoverflow.com/a/7205107)
+
+	Neither input is changed. Values only in one of them are shared with the output rather than copied.
+	"""
+	path = path or []
+	out = dict(a)
+	for k in b:
+		if k in a:
+			if isinstance(a[k], Mapping) and isinstance(b[k], Mapping):
+				out[k] = recursive_merge(a[k], b[k], path + [str(k)])
+			else:
+				out[k] = b[k]
+		else:
+			out[k] = b[k]
+	return out
@@ -0,0 +1,818 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+DOCUMENTATION = """
+---
+module: lilatomic.api.http
+short_description: A nice and friendly HTTP API
+description:
+  - An easy way to use the [requests](https://docs.python-requests.org/en/master/) library to make HTTP requests
+  - Define connections and re-use them across tasks
+version_added: "0.1.0"
+options:
+  connection:
+    description:
+      - the name of the connection to use
+      - connections are keyed under `lilatomic_api_http` and take `base`, `auth`, `kwargs`, `pool_size`, `session_ttl`, `cache`, `retry`, `circuit_breaker`, `rate_limit`, `transport`, `http2`, `har` and `cassette`
+      - a connection's `har` records every request made through it, with timings, into the HAR file at `path`. The file is shared by all forks and is valid between tasks. The Authorization header is censored unless `log_auth` is true, and bodies are only recorded if `bodies` is true
+      - a connection's `base` can be `unix:///path/to.sock` for the API of a local daemon or sidecar proxy. Requests go over a pool of connections to the socket, with `localhost` as their host, and ignore proxies from the environment. Unix sockets use the `requests` transport
+      - "a connection's `cassette` saves responses to the file at `path` with `mode: record`, and answers requests from it without the network with `mode: replay`. Requests match on their method, normalised URL and a hash of their body, and on the socket of a Unix socket connection; a request recorded more than once replays its responses in order, repeating the last. A request missing from the cassette fails. Replayed requests aren't authenticated, so no tokens are fetched. Recording reads whole bodies into memory, even with `dest` or `stream_items`"
+      - a connection's `transport` is `requests` (the default) or `httpx`. The httpx transport requires the httpx library (`pip install httpx[http2]`) and speaks HTTP/2 unless `http2` is false, so concurrent requests from `requests` or `paginate` are multiplexed over one connection per origin
+      - a connection's `auth` takes a `method` of `basic` (`username`, `password`), `bearer` (`token`) or `oauth2_client_credentials` (`token_url`, `client_id`, `client_secret`, and optionally `scope`, `audience` and `client_auth` of `basic` or `body`). OAuth2 tokens are cached in memory and in a file in `path` (default ~/.cache/lilatomic_api_http/state), shared by all tasks and forks, and refreshed `refresh_margin` seconds (default 60) before they expire, or once a request with one is answered with a 401. They are fetched with the connection's `verify`, `cert`, `proxies` and `timeout` kwargs
+      - a connection's `rate_limit` takes a `rate` in requests per second and a `burst` (default `rate`). It is enforced with a token bucket shared by all forks through a file in `path` (default ~/.cache/lilatomic_api_http/state), and each retry takes a token too
+      - requests made through the same connection in a worker process share a keep-alive session. `pool_size` (default 10) bounds the connections kept open per host; the session is closed after `session_ttl` seconds (default 300)
+    required: true
+    type: string
+  method:
+    description: the HTTP method to use
+    required: true
+    default: GET
+    type: string
+  path:
+    description: the slug to join to the connection's base
+  data:
+    description: object to send in the body of the request.
+    required: false
+    type: string or dict
+  json:
+    description: json data to send in the body of the request.
+    required: false
+    type: string or dict
+  headers:
+    description: HTTP headers for the request
+    required: false
+    type: dict
+    default: dict()
+  status_code:
+    description: acceptable status codes
+    required: false
+    default: requests default, status_code < 400
+    type: list
+    elements: int
+  timeout:
+    description: timeout in seconds of the request
+    required: false
+    default: 15
+    type: float
+  log_request:
+    description: returns information about the request. Useful for debugging. Censors Authorization header unless log_auth is used.
+    required: false
+    default: false
+    type: bool
+  log_auth:
+    description: uncensors the Authorization header.
+    required: false
+    default: false
+    type: bool
+  kwargs:
+    description: Access hatch for passing kwargs to the requests.request method. Recursively merged with and overrides kwargs set on the connection.
+    required: false
+    default: None
+    type: dict
+  compress:
+    description:
+      - compress the request body with this Content-Encoding, if it is at least `compress_min_size` bytes
+      - compressing with `zstd` requires the zstandard library, and with `br` the brotli library
+      - responses are decoded whatever this is set to. Installing brotli and zstandard advertises and decodes `br` and `zstd` responses too
+    required: false
+    choices: [ gzip, deflate, zstd, br ]
+    type: string
+  compress_min_size:
+    description: bodies smaller than this many bytes are sent uncompressed
+    required: false
+    default: 1024
+    type: int
+  paginate:
+    description:
+      - follow the pages of a paginated response, and return the items of every page in `items`
+      - pagination stops at a page without items, at `max_pages`, or at a page with an unacceptable status, which is returned as the result
+    required: false
+    type: dict
+    suboptions:
+      style:
+        description: how the next page is found. `link` follows the Link header with rel="next", `cursor` sends the value at `cursor_path` in the body as `cursor_param`, `page` counts `page_param` up from `start` by `step`
+        default: link
+        choices: [ link, cursor, page ]
+      items:
+        description: dotted path to the list of items in each page's body, for example `data.items`. Required unless the body is a list, which is then the items
+        type: string
+      cursor_path:
+        description: dotted path to the next cursor in the body. Required for `cursor` pagination
+        type: string
+      cursor_param:
+        description: the query parameter the cursor is sent as
+        default: cursor
+        type: string
+      page_param:
+        description: the query parameter the page number or offset is sent as
+        default: page
+        type: string
+      start:
+        description: the first page number or offset
+        default: 1
+        type: int
+      step:
+        description: how much to increase the page parameter by. Use the page size for offset pagination
+        default: 1
+        type: int
+      max_pages:
+        description: stop after this many pages
+        type: int
+      prefetch:
+        description: for `page` pagination, the number of pages to request ahead of the one being read
+        default: 0
+        type: int
+      dest:
+        description: write the items to this file as JSON Lines, instead of returning them
+        type: path
+  stream_items:
+    description:
+      - parse a JSON body as it arrives, and return only the items at `path` in `items`. Requires the ijson library
+      - the body is never held in memory, only the items kept are. With a `dest`, memory is bounded by a single item
+      - the body is not returned in `content`, `msg` or `json`
+    required: false
+    type: dict
+    suboptions:
+      path:
+        description: dotted path to the items, where `*` is each element of an array. For example `data.servers.*`, or `*` for a body which is an array
+        required: true
+        type: string
+      filter:
+        description: a JMESPath expression; only items it is truthy for are kept. Requires the jmespath library
+        type: string
+      limit:
+        description: stop reading the body after this many items are kept
+        type: int
+      dest:
+        description: write the items to this file as JSON Lines, instead of returning them
+        type: path
+  wait_for:
+    description:
+      - poll until a condition is met, reusing the connection, and return the last response. Each poll is retried according to `retry`
+      - the task fails if the condition isn't met within `timeout` seconds
+    required: false
+    type: dict
+    suboptions:
+      status:
+        description: statuses which end the wait, like 404 when waiting for something to be deleted. Defaults to any status acceptable to `status_code`
+        type: list
+        elements: int
+      path:
+        description: dotted path to a value in the JSON body which must be `value`, for example `operation.state`
+        type: string
+      value:
+        description: the value expected at `path`. Without it, the value must be truthy
+        type: raw
+      timeout:
+        description: seconds to keep polling for
+        default: 300
+        type: float
+      delay:
+        description: seconds to wait before the second poll
+        default: 1
+        type: float
+      backoff:
+        description: how much longer each wait is than the one before it. A Retry-After header on a response overrides it
+        default: 1.5
+        type: float
+      max_delay:
+        description: the longest wait between polls
+        default: 30
+        type: float
+  shared:
+    description:
+      - make a GET once for every host running the task, and share the result. The first fork to get there makes the request, while the others wait for it on a lock file and then reuse its result
+      - use it for lookups which are the same for every host, like fetching a shared document. Hosts share a result only if their task args and connection definition are identical
+      - successful results are reused for `shared_ttl` seconds, so batches of hosts which run later share them too. Failed results are only kept for a few seconds, so hosts already waiting for the request fail with it and later tasks try again
+    required: false
+    default: false
+    type: bool
+  shared_ttl:
+    description: seconds a `shared` result is reused for
+    required: false
+    default: 60
+    type: float
+  shared_path:
+    description: directory `shared` results and their locks are kept in. Expired results are removed whenever a new one is stored
+    required: false
+    default: ~/.cache/lilatomic_api_http/state
+    type: path
+  timing:
+    description:
+      - return a `timing` breakdown of where the time went, in seconds
+      - for `requests` and `paginate`, `timing` instead summarises every request made to the connection
+    required: false
+    default: false
+    type: bool
+  return_fields:
+    description:
+      - only return these fields of the result. `failed`, `extracted` and `timing` are always returned.
+      - bodies are only decoded if a field that needs them is returned, so leaving out `content`, `msg` and `json` saves decoding as well as memory on the controller
+    required: false
+    default: all fields
+    type: list
+    elements: str
+  extract:
+    description: a JMESPath expression evaluated against the JSON body, returned in `extracted`. Requires the jmespath library
+    required: false
+    type: string
+  dest:
+    description:
+      - path of a file to stream the response body into. The body is written a chunk at a time, and is not returned in `content`, `msg` or `json`.
+      - the file is only replaced once the download completes and the response status is acceptable
+    required: false
+    type: path
+  checksum_algorithm:
+    description: the hashlib algorithm used for the `checksum` of a `dest` download
+    required: false
+    default: sha256
+    type: string
+  expected_checksum:
+    description: the hex digest, in `checksum_algorithm`, a `dest` download must have. If it doesn't, `dest` is left as it was and the task fails
+    required: false
+    type: string
+  segments:
+    description:
+      - download `dest` as this many byte ranges at once, each over its own pooled connection. Helps most on high-latency links
+      - "needs a server which answers HEAD with a Content-Length and `Accept-Ranges: bytes`; otherwise the body is downloaded as one stream"
+      - each range is written to a `.partN` file next to `dest`. If the download is interrupted, running the task again resumes each range where it stopped, as long as the resource's size and ETag or Last-Modified are unchanged
+    required: false
+    default: 1
+    type: int
+  cache:
+    description:
+      - use the connection's response cache for this request, if it has one. Only GET requests are cached.
+      - the connection's `cache` takes a `path` (default ~/.cache/lilatomic_api_http) and a `max_size` in bytes (default 256MiB). Responses with an ETag or Last-Modified header are stored, and are revalidated with If-None-Match or If-Modified-Since on the next request. A 304 Not Modified returns the cached response.
+    required: false
+    default: true
+    type: bool
+  retry:
+    description:
+      - how to retry failed requests. Recursively merged with and overrides `retry` set on the connection. By default requests are not retried
+      - waits grow exponentially from `backoff` with full jitter, or follow the response's Retry-After header, and are capped at `max_backoff`
+      - a connection's `circuit_breaker` takes a `threshold` (default 5) of consecutive failed requests after which requests to the connection fail immediately, for `reset_after` seconds (default 30). Its state is shared by all forks through a file in `path` (default ~/.cache/lilatomic_api_http/state)
+    required: false
+    type: dict
+    suboptions:
+      attempts:
+        description: the maximum number of attempts, including the first
+        default: 1
+        type: int
+      backoff:
+        description: seconds to wait before the first retry, doubled for each retry after it
+        default: 0.5
+        type: float
+      max_backoff:
+        description: the longest wait between attempts
+        default: 30
+        type: float
+      statuses:
+        description: response statuses to retry
+        default: [ 429, 502, 503, 504 ]
+        type: list
+        elements: int
+      exceptions:
+        description: names of exceptions from requests.exceptions to retry
+        default: [ ConnectionError, Timeout ]
+        type: list
+        elements: str
+      methods:
+        description: HTTP methods which are safe to retry
+        default: [ GET, HEAD, OPTIONS, PUT, DELETE ]
+        type: list
+        elements: str
+  requests:
+    description:
+      - make many requests in one task. Each element takes the same options as the task (`path`, `method`, `json`, ...), and task-level options are defaults for every element.
+      - results are returned in `results`, in the same order as the requests
+    required: false
+    type: list
+    elements: dict
+  max_concurrency:
+    description: the number of requests from `requests` in flight at once. Raise the connection's `pool_size` to match, or connections will be discarded instead of reused
+    required: false
+    default: 10
+    type: int
+"""
+
+EXAMPLES = """
+---
+- name: post
+  lilatomic.api.http:
+    connection: httpbin
+    method: POST
+    path: /post
+    data:
+      1: 1
+      2: 2
+  vars:
+    lilatomic_api_http:
+      httpbin:
+        base: "https://httpbingo.org/"
+
+- name: GET with logging of the request
+  lilatomic.api.http:
+    connection: fishbike
+    path: /
+    log_request: true
+  vars:
+    lilatomic_api_http:
+      httpbin:
+        base: "https://httpbingo.org/"
+
+- name: GET with Bearer auth
+  lilatomic.api.http:
+    connection: httpbin_bearer
+    path: /bearer
+    log_request: true
+    log_auth: true
+  vars:
+    lilatomic_api_http:
+      httpbin_bearer:
+        base: "https://httpbin.org"
+        auth:
+          method: bearer
+          token: hihello
+
+- name: GET with an OAuth2 token shared by every host
+  lilatomic.api.http:
+    connection: graph
+    path: /users
+  vars:
+    lilatomic_api_http:
+      graph:
+        base: "https://api.example.com/v1/"
+        auth:
+          method: oauth2_client_credentials
+          token_url: "https://login.example.com/oauth2/token"
+          client_id: "{{ graph_client_id }}"
+          client_secret: "{{ graph_client_secret }}"
+          scope: [ "users.read" ]
+
+- name: Use Kwargs for disallowing redirects
+  lilatomic.api.http:
+    connection: httpbin
+    path: redirect-to?url=get
+    kwargs:
+      allow_redirects: false
+    status_code: [ 302 ]
+  vars:
+    lilatomic_api_http:
+      httpbin:
+        base: "https://httpbingo.org/"
+
+- name: Keep a larger pool of connections open for longer
+  lilatomic.api.http:
+    connection: httpbin_pooled
+    path: /get
+  vars:
+    lilatomic_api_http:
+      httpbin_pooled:
+        base: "https://httpbingo.org/"
+        pool_size: 50
+        session_ttl: 900
+
+- name: Compress a large configuration upload
+  lilatomic.api.http:
+    connection: config_server
+    method: PUT
+    path: /documents/site.json
+    json: "{{ site_config }}"
+    compress: gzip
+  vars:
+    lilatomic_api_http:
+      config_server:
+        base: "https://config.example.com/"
+
+- name: Fetch every page of an inventory, 4 pages ahead
+  lilatomic.api.http:
+    connection: cmdb
+    path: /servers
+    kwargs:
+      params:
+        per_page: 100
+    paginate:
+      style: page
+      items: data.servers
+      prefetch: 4
+  vars:
+    lilatomic_api_http:
+      cmdb:
+        base: "https://cmdb.example.com/api/"
+
+- name: Only bring back the part of the body we need
+  lilatomic.api.http:
+    connection: cmdb
+    path: /servers
+    extract: "items[?state == 'active'].name"
+    return_fields: [ status ]
+  vars:
+    lilatomic_api_http:
+      cmdb:
+        base: "https://cmdb.example.com/api/"
+
+- name: Pick the active servers out of a very large listing
+  lilatomic.api.http:
+    connection: cmdb
+    path: /servers/export
+    stream_items:
+      path: data.servers.*
+      filter: "state == 'active'"
+      dest: /tmp/active_servers.jsonl
+  vars:
+    lilatomic_api_http:
+      cmdb:
+        base: "https://cmdb.example.com/api/"
+
+- name: Download an artifact without holding it in memory
+  lilatomic.api.http:
+    connection: artifacts
+    path: /releases/app-1.2.3.tar.gz
+    dest: /tmp/app-1.2.3.tar.gz
+  vars:
+    lilatomic_api_http:
+      artifacts:
+        base: "https://artifacts.example.com/"
+
+- name: Revalidate a large document instead of downloading it every time
+  lilatomic.api.http:
+    connection: config_server
+    path: /documents/site.json
+  vars:
+    lilatomic_api_http:
+      config_server:
+        base: "https://config.example.com/"
+        cache:
+          path: /var/cache/lilatomic_api_http
+          max_size: 1073741824
+
+- name: Retry a flaky upstream, and stop calling it if it goes down
+  lilatomic.api.http:
+    connection: flaky
+    path: /status
+  vars:
+    lilatomic_api_http:
+      flaky:
+        base: "https://flaky.example.com/"
+        retry:
+          attempts: 5
+          backoff: 1
+        circuit_breaker:
+          threshold: 3
+          reset_after: 60
+
+- name: Stay under an API's quota across every fork
+  lilatomic.api.http:
+    connection: saas
+    path: /users
+  vars:
+    lilatomic_api_http:
+      saas:
+        base: "https://api.saas.example.com/"
+        rate_limit:
+          rate: 10
+          burst: 20
+
+- name: Multiplex many requests over one HTTP/2 connection
+  lilatomic.api.http:
+    connection: gateway
+    max_concurrency: 50
+    requests:
+      - path: /devices/1
+      - path: /devices/2
+  vars:
+    lilatomic_api_http:
+      gateway:
+        base: "https://gateway.example.com/"
+        transport: httpx
+
+- name: Record every call to an API in a HAR file for the whole run
+  lilatomic.api.http:
+    connection: cmdb_recorded
+    path: /servers
+  vars:
+    lilatomic_api_http:
+      cmdb_recorded:
+        base: "https://cmdb.example.com/api/"
+        har:
+          path: "{{ playbook_dir }}/run.har"
+
+- name: Download a large artifact as 8 ranges at once, and check it
+  lilatomic.api.http:
+    connection: artifacts
+    path: /releases/app-1.2.3.tar.gz
+    dest: /tmp/app-1.2.3.tar.gz
+    segments: 8
+    expected_checksum: "2d515b7c0ba873db3774b5adeaa9ed5cff44c5b06137bacd1a5ecf9c7e621d99"
+  vars:
+    lilatomic_api_http:
+      artifacts:
+        base: "https://artifacts.example.com/"
+        pool_size: 8
+
+- name: List containers through the Docker socket
+  lilatomic.api.http:
+    connection: docker
+    path: /v1.43/containers/json
+  vars:
+    lilatomic_api_http:
+      docker:
+        base: "unix:///var/run/docker.sock"
+
+- name: Replay responses recorded in an earlier run, for fast and deterministic CI
+  lilatomic.api.http:
+    connection: cmdb_replayed
+    path: /servers
+  vars:
+    lilatomic_api_http:
+      cmdb_replayed:
+        base: "https://cmdb.example.com/api/"
+        cassette:
+          path: "{{ playbook_dir }}/cassettes/cmdb.jsonl"
+          mode: "{{ 'record' if record_cassettes | default(false) else 'replay' }}"
+
+- name: Wait for a provisioning operation to finish
+  lilatomic.api.http:
+    connection: cloud
+    path: "/operations/{{ operation_id }}"
+    wait_for:
+      path: status
+      value: done
+      timeout: 1800
+      delay: 5
+      max_delay: 60
+  vars:
+    lilatomic_api_http:
+      cloud:
+        base: "https://cloud.example.com/api/"
+
+- name: Fetch the feature flags once, rather than once per host
+  lilatomic.api.http:
+    connection: flags
+    path: /flags
+    shared: true
+  vars:
+    lilatomic_api_http:
+      flags:
+        base: "https://flags.example.com/api/"
+
+- name: Make many requests in one task
+  lilatomic.api.http:
+    connection: cmdb
+    method: PUT
+    max_concurrency: 20
+    requests:
+      - path: /servers/web01
+        json: { "role": "web" }
+      - path: /servers/db01
+        json: { "role": "db" }
+  vars:
+    lilatomic_api_http:
+      cmdb:
+        base: "https://cmdb.example.com/api/"
+        pool_size: 20
+"""
+
+RETURN = """
+---
+json:
+  description: json body
+  returned: response has headers Content-Type == "application/json", and the body was not written to `dest`
+  type: complex
+  sample: {
+    "authenticated": true,
+    "token": "hihello"
+  }
+content:
+  description: response.content
+  returned: when the body was not written to `dest`
+  type: str
+  sample: |
+    {\\n  "authenticated": true, \\n  "token": "hihello"\\n}\\n
+msg:
+  description: response body
+  returned: when the body was not written to `dest`
+  type: str
+  sample: |
+    {\\n  "authenticated": true, \\n  "token": "hihello"\\n}\\n
+content-length:
+  description: response Content-Length header
+  returned: always
+  type: int
+  sample: 51
+content-type:
+  description: response Content-Type header
+  returned: always
+  type: string
+  sample: "application/json"
+cookies:
+  description: the cookies from the response
+  returned: always
+  type: dict
+  sample: { }
+date:
+  description: response Date header
+  returned: always
+  type: str
+  sample: "Sat, 10 Jul 2021 23:14:14 GMT"
+elapsed:
+  description: seconds elapsed making the request
+  returned: always
+  type: int
+  sample: 0
+timing:
+  description:
+    - seconds spent in each phase of the request. `dns`, `connect` and `tls` are 0 when a pooled connection was reused; the httpx transport counts name resolution in `connect`
+    - for `requests` and `paginate`, the total, mean, p50, p95 and max of each phase across all requests, with the number of requests and of connections opened
+  returned: when timing is set
+  type: dict
+  sample: {
+    "connection_reused": false,
+    "dns": 0.0012,
+    "connect": 0.0107,
+    "tls": 0.0445,
+    "ttfb": 0.1309,
+    "transfer": 0.0026,
+    "decode": 0.0166,
+    "total": 0.2065
+  }
+redirected:
+  description: if response was redirected
+  returned: always
+  type: bool
+  sample: false
+server:
+  description: response Server header
+  returned: always
+  type: str
+  sample: "gunicorn/19.9.0"
+status:
+  description: response status code; alias for status_code
+  returned: always
+  type: str
+  sample: 200
+url:
+  description: the URL from the response
+  returned: always
+  type: str
+  sample: "https://httpbin.org/bearer"
+encoding:
+  description: response encoding
+  returned: always
+  type: str
+  sample: "utf-8"
+headers:
+  description: response headers
+  returned: always
+  type: dict
+  elements: str
+  sample: {
+    "Access-Control-Allow-Credentials": "true",
+    "Access-Control-Allow-Origin": "*",
+    "Connection": "keep-alive",
+    "Content-Length": "51",
+    "Content-Type": "application/json",
+    "Date": "Sat, 10 Jul 2021 23:14:14 GMT",
+    "Server": "gunicorn/19.9.0"
+  }
+reason:
+  description: response status reason
+  returned: always
+  type: str
+  sample: "OK"
+status_code:
+  description: response status code
+  returned: always
+  type: str
+  sample: 200
+request:
+  description: the original request, useful for debugging
+  returned: when log_request == true
+  type: complex
+  contains:
+    body:
+      description: request body
+      returned: always
+      type: str
+    headers:
+      description: request headers. Authorization will be censored unless `log_auth` == true
+      returned: always
+      type: dict
+      elements: str
+    method:
+      description: request HTTP method
+      returned: always
+      type: str
+    path_url:
+      description: request path url; the part of the url which is called the path; that's its technical name
+      returned: always
+      type: str
+    url:
+      description: the full url
+      returned: always
+      type: str
+  sample: {
+    "body": null,
+    "headers": {
+      "Accept": "*/*",
+      "Accept-Encoding": "gzip, deflate",
+      "Authorization": "Bearer hihello",
+      "Connection": "keep-alive",
+      "User-Agent": "python-requests/2.25.1"
+    },
+    "method": "GET",
+    "path_url": "/bearer",
+    "url": "https://httpbin.org/bearer"
+  }
+items:
+  description: the items of every page, or the items kept by `stream_items`, in order
+  returned: when paginate or stream_items is set without a dest
+  type: list
+  sample: [ { "name": "web01" }, { "name": "db01" } ]
+item_count:
+  description: the number of items across all pages, or kept by `stream_items`
+  returned: when paginate or stream_items is set
+  type: int
+  sample: 2
+pages:
+  description: the number of pages requested
+  returned: when paginate is set
+  type: int
+  sample: 1
+extracted:
+  description: the result of evaluating `extract` against the JSON body
+  returned: when extract is set
+  type: complex
+  sample: [ "web01", "db01" ]
+dest:
+  description: the file the body, the items of all pages, or the streamed items were written to
+  returned: when dest, or the dest of paginate or stream_items, is set
+  type: str
+  sample: "/tmp/app-1.2.3.tar.gz"
+size:
+  description: bytes written to `dest`
+  returned: when dest is set
+  type: int
+  sample: 52428800
+checksum:
+  description: hex digest of the body written to `dest`
+  returned: when dest is set
+  type: str
+  sample: "2d515b7c0ba873db3774b5adeaa9ed5cff44c5b06137bacd1a5ecf9c7e621d99"
+checksum_algorithm:
+  description: the algorithm used for `checksum`
+  returned: when dest is set
+  type: str
+  sample: "sha256"
+segments:
+  description: the number of byte ranges `dest` was downloaded as
+  returned: when segments is set and the server supports ranges
+  type: int
+  sample: 8
+resumed_size:
+  description: bytes of a segmented download which were already downloaded by an interrupted run
+  returned: when segments is set and the server supports ranges
+  type: int
+  sample: 0
+download_time:
+  description: seconds spent transferring the body to `dest`
+  returned: when dest is set
+  type: float
+  sample: 0.136
+polls:
+  description: the number of requests made while waiting
+  returned: when wait_for is set
+  type: int
+  sample: 4
+wait_time:
+  description: seconds spent waiting
+  returned: when wait_for is set
+  type: float
+  sample: 9.7
+coalesced:
+  description: whether the result of a `shared` request was made by another fork and reused
+  returned: when shared is set
+  type: bool
+  sample: true
+stream_time:
+  description: seconds spent reading the body for `stream_items`
+  returned: when stream_items is set
+  type: float
+  sample: 0.412
+attempts:
+  description: the number of attempts it took to get the response
+  returned: when the request was retried
+  type: int
+  sample: 3
+cached:
+  description: whether the response was served from the cache after revalidation
+  returned: when the connection has a cache
+  type: bool
+  sample: true
+results:
+  description: the result of each request, in the same order as `requests`. Each has the same fields as a single request
+  returned: when requests is set
+  type: list
+  elements: dict
+"""
\ No newline at end of file
@@ -0,0 +1,312 @@
+DOCUMENTATION = """
+---
+author: lilatomic
+httpapi: http
+short_description: generic http connection
+description: 
+  - This HttpApi plugin provides a generic HTTP client. This makes it quicker to interact with HTTP APIs than using the URI module
+  - "`send_requests` sends a list of requests in one call, so a module can make many requests while paying for a single round trip to the persistent connection"
+  - GET results can be cached in the persistent connection process with `cache`, so every task using the connection shares them. `cache` is `true` or a dict with a default `ttl` in seconds and `rules` mapping path prefixes to their own TTL, where the longest matching prefix wins. Cached results are only reused while they are younger than the TTL, and the least recently used are evicted past 256 entries. A POST, PUT, PATCH or DELETE drops cached results under its path and for its parent collection. Results of cached requests report whether they were a hit, and the connection's hit and miss counts, in `cache`
+  - Bodies are encoded and decoded with the codec for their content type. JSON is built in, and msgpack and CBOR are available with the msgpack and cbor2 libraries. `codec` picks the one request bodies are sent in and responses are asked for in; the other available ones are accepted too. Other codecs can be added with `register_codec`. Responses of other content types are returned as text
+  - Newline-delimited JSON responses are decoded into a list of records. Records, and the items of a JSON array, can be capped with `max_records` or sampled with `sample_records`, so only those are sent back to the module
+"""
+
+import itertools
+import json
+import random
+import time
+from collections import OrderedDict
+
+from ansible.errors import AnsibleError
+from ansible.plugins.httpapi import HttpApiBase
+
+try:
+	import ijson
+
+	HAS_IJSON = True
+except ImportError:
+	HAS_IJSON = False
+
+try:
+	import msgpack
+
+	HAS_MSGPACK = True
+except ImportError:
+	HAS_MSGPACK = False
+
+try:
+	import cbor2
+
+	HAS_CBOR2 = True
+except ImportError:
+	HAS_CBOR2 = False
+
+EMPTY_DATA = object()
+
+# content types with one JSON document per line
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines", "application/json-seq")
+# RFC 7464 starts each record of a JSON text sequence with this
+RECORD_SEPARATOR = b"\x1e"
+
+DEFAULT_CODEC = "json"
+
+DEFAULT_CACHE_TTL = 60
+DEFAULT_CACHE_ENTRIES = 256
+MUTATING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class Codec(object):
+	""" How bodies of a content type are encoded and decoded
+
+	Structured syntax suffixes, like the `+json` of `application/problem+json`, also match.
+	"""
+
+	def __init__(self, content_type, encode, decode, aliases=(), suffix=None, available=True, library=None):
+		self.content_type = content_type
+		self.encode = encode
+		self.decode = decode
+		self.content_types = (content_type,) + tuple(aliases)
+		self.suffix = suffix
+		self.available = available
+		self.library = library
+
+	def matches(self, content_type) -> bool:
+		return content_type in self.content_types or bool(self.suffix and content_type.endswith(self.suffix))
+
+	def check(self):
+		if not self.available:
+			raise AnsibleError(f"the {self.content_type} codec requires the {self.library} library, install it with `pip install {self.library}`")
+
+
+CODECS = {}
+
+
+def register_codec(name, codec):
+	CODECS[name] = codec
+
+
+register_codec("json", Codec("application/json", lambda data: json.dumps(data).encode("utf-8"), json.loads, suffix="+json"))
+register_codec("msgpack", Codec(
+	"application/msgpack",
+	lambda data: msgpack.packb(data, use_bin_type=True),
+	lambda body: msgpack.unpackb(body, raw=False),
+	aliases=("application/x-msgpack", "application/vnd.msgpack"),
+	available=HAS_MSGPACK,
+	library="msgpack",
+	))
+register_codec("cbor", Codec(
+	"application/cbor",
+	lambda data: cbor2.dumps(data),
+	lambda body: cbor2.loads(body),
+	suffix="+cbor",
+	available=HAS_CBOR2,
+	library="cbor2",
+	))
+
+
+def codec_for(content_type):
+	""" The codec for a content type, or None if there isn't one """
+	for codec in CODECS.values():
+		if codec.matches(content_type):
+			return codec
+	return None
+
+
+def accept_header(preferred):
+	""" The preferred codec's content type first, then any other available codec's """
+	others = [c.content_type for name, c in CODECS.items() if c.available and name != preferred]
+	return ", ".join([CODECS[preferred].content_type] + [f"{content_type};q=0.5" for content_type in others])
+
+
+class ResponseCache(object):
+	""" LRU cache of GET results, which lives as long as the persistent connection """
+
+	def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+
+	@staticmethod
+	def key(path, data, max_records, sample_records, codec):
+		# the codec picks the Accept header, so results in other codecs can differ
+		return json.dumps([path, data, max_records, sample_records, codec], sort_keys=True, default=str)
+
+	@staticmethod
+	def ttl(path, settings):
+		""" The TTL for a path, from the longest matching prefix in the rules """
+		if not isinstance(settings, dict):
+			return DEFAULT_CACHE_TTL
+		rules = settings.get("rules") or {}
+		matching = [prefix for prefix in rules if path.startswith(prefix)]
+		if matching:
+			return float(rules[max(matching, key=len)])
+		return float(settings.get("ttl", DEFAULT_CACHE_TTL))
+
+	def get(self, key, ttl):
+		entry = self._entries.get(key)
+		if entry is not None and time.monotonic() - entry[1] < ttl:
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[2]
+		self.misses += 1
+		return None
+
+	def put(self, key, path, result):
+		self._entries[key] = (resource(path), time.monotonic(), result)
+		self._entries.move_to_end(key)
+		while len(self._entries) > self.max_entries:
+			self._entries.popitem(last=False)
+
+	def invalidate(self, path):
+		""" Drop results under a changed resource, and for the collection it is in """
+		changed = resource(path)
+		parent = changed.rsplit("/", 1)[0]
+		stale = [key for key, (cached, _, _) in self._entries.items() if cached in (changed, parent) or cached.startswith(changed + "/")]
+		for key in stale:
+			del self._entries[key]
+
+	def stats(self, hit):
+		return {"hit": hit, "hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class HttpApi(HttpApiBase):
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.response_cache = ResponseCache()
+
+	def send_request(self, path, data=EMPTY_DATA, method="GET", max_records=None, sample_records=None, cache=None, codec=None, **message_kwargs):
+		codec = codec or DEFAULT_CODEC
+		if codec not in CODECS:
+			raise AnsibleError(f"unknown codec `{codec}`, expected one of {', '.join(CODECS)}")
+		CODECS[codec].check()
+
+		if method.upper() in MUTATING_METHODS:
+			self.response_cache.invalidate(path)
+		if not cache or method.upper() != "GET":
+			return self.send_uncached(path, data, method, max_records, sample_records, codec)
+
+		key = self.response_cache.key(path, None if data is EMPTY_DATA else data, max_records, sample_records, codec)
+		cached = self.response_cache.get(key, self.response_cache.ttl(path, cache))
+		if cached is not None:
+			return {**cached, "cache": self.response_cache.stats(hit=True)}
+
+		out = self.send_uncached(path, data, method, max_records, sample_records, codec)
+		if 200 <= out["response"]["code"] < 300:
+			self.response_cache.put(key, path, out)
+		return {**out, "cache": self.response_cache.stats(hit=False)}
+
+	def send_uncached(self, path, data, method, max_records, sample_records, codec):
+		# set headers for body
+		headers = {'Accept': accept_header(codec)}
+		if not data or data == EMPTY_DATA:
+			body = None
+		else:
+			body = CODECS[codec].encode(data)
+			headers['Content-Type'] = CODECS[codec].content_type
+
+		# actually send the connection
+		r, r_data = self.connection.send(path=path, data=body, method=method, headers=headers)
+
+		out = {
+			"response": {
+				"msg": r.msg,
+				"code": r.code,
+				},
+			"request": {
+				"url": r.url
+				}
+			}
+		content_type = (r.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+		out["response"].update(decode(r_data, content_type, max_records, sample_records))
+		return out
+
+	def send_requests(self, requests):
+		""" Send each request in turn over the kept-alive connection, returning every result in order
+
+		A request which raises is reported as failed, and the rest are still sent.
+		"""
+		results = []
+		for request in requests:
+			try:
+				results.append(self.send_request(**request))
+			except Exception as e:
+				results.append({"failed": True, "msg": f"{e}", "request": {"path": request.get("path")}})
+		return {
+			"failed": any(result.get("failed") for result in results),
+			"results": results,
+			}
+
+
+def resource(path):
+	""" The path without its query, or a trailing slash """
+	return path.split("?", 1)[0].rstrip("/")
+
+
+def decode(r_data, content_type, max_records=None, sample_records=None):
+	""" Decode a body straight from its bytes, as a list of records if it is newline-delimited or if records are capped or sampled """
+	if content_type in NDJSON_TYPES:
+		return collect(ndjson_records(r_data), max_records, sample_records)
+
+	codec = codec_for(content_type)
+	if max_records or sample_records:
+		if HAS_IJSON and codec is CODECS["json"] and is_array(r_data):
+			# only the records kept are ever decoded into memory
+			return collect(ijson.items(r_data, "item", use_float=True), max_records, sample_records)
+		document = load(r_data, codec)
+		if isinstance(document, list):
+			return collect(iter(document), max_records, sample_records)
+		return {"data": document}
+
+	return {"data": load(r_data, codec)}
+
+
+def load(r_data, codec):
+	# codecs take bytes, so the body isn't copied into a str first
+	body = r_data.read()
+	if not body.strip():
+		return None
+	if codec is not None:
+		codec.check()
+		return codec.decode(body)
+	# without a content type we know, it may still be JSON
+	try:
+		return json.loads(body)
+	except ValueError:
+		return body.decode("utf-8", "replace")
+
+
+def is_array(r_data) -> bool:
+	""" Whether the body is a JSON array, leaving the body where it was """
+	start = r_data.tell()
+	head = r_data.read(64).lstrip()
+	r_data.seek(start)
+	return head.startswith(b"[")
+
+
+def ndjson_records(r_data):
+	for line in r_data:
+		line = line.strip().lstrip(RECORD_SEPARATOR)
+		if line:
+			yield json.loads(line)
+
+
+def collect(records, max_records=None, sample_records=None):
+	""" Keep the first `max_records` records, or a uniform random sample of `sample_records` of them """
+	if sample_records:
+		kept = []
+		count = 0
+		# reservoir sampling, so only the sample is held
+		for count, record in enumerate(records, 1):
+			if len(kept) < sample_records:
+				kept.append(record)
+			else:
+				i = random.randrange(count)
+				if i < sample_records:
+					kept[i] = record
+		return {"data": kept, "record_count": count, "truncated": count > len(kept)}
+
+	kept = list(itertools.islice(records, max_records))
+	# one more tells us whether there were more, without reading the rest
+	truncated = max_records is not None and next(records, EMPTY_DATA) is not EMPTY_DATA
+	return {"data": kept, "record_count": len(kept), "truncated": truncated}
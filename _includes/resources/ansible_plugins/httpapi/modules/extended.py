@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+
+__metaclass__ = type
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.connection import Connection
+from ansible.utils.display import Display
+
+display = Display()
+
+
+def main():
+	argument_spec = {
+		"path": {"type": "str", "default": None},
+		"method": {"type": "str", "default": "GET"},
+		"data": {"type": "raw", "default": None},
+		# for newline-delimited responses and JSON arrays, only send back some of the records
+		"max_records": {"type": "int", "default": None},
+		"sample_records": {"type": "int", "default": None},
+		# reuse GET results cached by the connection: true, or a dict with a `ttl` and per-prefix `rules`
+		"cache": {"type": "raw", "default": None},
+		# the codec to send the body in and ask for the response in: json, msgpack or cbor
+		"codec": {"type": "str", "default": "json"},
+		# many requests in one call to the connection. The options above are defaults for each of them
+		"requests": {"type": "list", "elements": "dict", "default": None},
+		}
+
+	result = {}
+
+	module = AnsibleModule(argument_spec=argument_spec)
+	try:
+		# get reference to httpapi process through socket path for RMI
+		connection = Connection(module._socket_path)
+
+		request = {
+			"path": module.params.get("path"),
+			"method": module.params.get("method"),
+			"data": module.params.get("data"),
+			"max_records": module.params.get("max_records"),
+			"sample_records": module.params.get("sample_records"),
+			"cache": module.params.get("cache"),
+			"codec": module.params.get("codec"),
+			}
+		if module.params.get("requests") is None:
+			r = connection.send_request(**request)
+		else:
+			r = connection.send_requests(requests=[{**request, **item} for item in module.params.get("requests")])
+		result.update(r)
+		if result.get("failed"):
+			module.fail_json(msg="some requests failed", **result)
+		module.exit_json(**result)
+	except Exception as e:
+		module.fail_json(msg=f'{e}', **result)
+
+
+if __name__ == '__main__':
+	main()